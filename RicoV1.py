@@ -7,7 +7,6 @@ import pyttsx3
 import numpy as np
 import pyautogui
 import threading
-import time
 from tkinter import Label, Button, Frame
 from PIL import Image, ImageTk, ImageDraw, ImageFont
 from ultralytics import YOLO
@@ -87,7 +86,7 @@ class ObjectDetectionApp:
         if ret:
             self.process_frame(frame)
         
-        self.root.after(10, self.detect_objects)
+        self.root.after(1000, self.detect_objects)  # Un frame al secondo senza bloccare Tk
     
     def detect_screen_objects(self):
         if not self.screen_running:
@@ -99,7 +98,7 @@ class ObjectDetectionApp:
         self.process_frame(frame)
         
         if self.screen_running:
-            self.root.after(10, self.detect_screen_objects)
+            self.root.after(1000, self.detect_screen_objects)
     
     def process_frame(self, frame):
         results = model(frame)[0]
@@ -119,7 +118,6 @@ class ObjectDetectionApp:
             cv2.rectangle(frame, (text_x - 5, text_y - text_size[1] - 5), (text_x + text_size[0] + 5, text_y + 5), (255, 255, 255), -1)
             cv2.putText(frame, text, (text_x, text_y), font, 0.5, (0, 0, 0), 2)
         
-        time.sleep(1)  # Ritarda la visualizzazione di 1 secondo
         self.detected_objects = detected_objects_temp
         
         frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
@@ -1,36 +1,96 @@
-import tkinter as tk
-from tkinter import ttk, Menu
-from tkinter import Frame, Label, Text, Scrollbar, filedialog, messagebox
-import cv2
-import threading
 import time
-import pyautogui
-import numpy as np
-from PIL import Image, ImageTk, ImageDraw
+import threading
+import importlib
+import argparse
+from contextlib import contextmanager
+
+class StartupProfiler:
+    """Misura i tempi di import e di inizializzazione dei sottosistemi all'avvio"""
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.timings = []  # (nome, secondi) nell'ordine di completamento
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.timings.append((name, time.perf_counter() - start))
+
+    def report(self):
+        with self._lock:
+            timings = list(self.timings)
+        lines = ["Profilo di avvio R.I.C.O:"]
+        lines += [f"  {name:<32} {seconds * 1000:9.1f} ms" for name, seconds in timings]
+        lines.append(f"  {'totale (wall clock)':<32} {(time.perf_counter() - self.start) * 1000:9.1f} ms")
+        return "\n".join(lines)
+
+startup_profile = StartupProfiler()
+
+with startup_profile.measure("import tkinter"):
+    import tkinter as tk
+    from tkinter import ttk, Menu
+    from tkinter import Frame, Label, Text, Scrollbar, filedialog, messagebox, simpledialog
+with startup_profile.measure("import cv2"):
+    import cv2
+with startup_profile.measure("import numpy"):
+    import numpy as np
+with startup_profile.measure("import PIL"):
+    from PIL import Image, ImageTk, ImageDraw
+with startup_profile.measure("import mss"):
+    import mss  # Per screenshot più veloci
+import gc
+import queue
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+import asyncio
+import base64
+import hashlib
 import sqlite3
 from datetime import datetime
 import os
 import json
 import logging
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import csv
+import bisect
+from collections import deque
 from functools import lru_cache
-import mss  # Per screenshot più veloci
-import gc    # Per la gestione della memoria
-import speech_recognition as sr
-import pyttsx3
-import pandas as pd
-import plotly.express as px
-import pygame
 import math
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image
-from reportlab.lib.styles import getSampleStyleSheet
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+class LazyModule:
+    """Rimanda l'import di una dipendenza pesante al primo accesso a un suo attributo"""
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                with startup_profile.measure(f"import {self._name} (lazy)"):
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._module or self._load(), attr)
+
+# Usate solo dietro pulsanti specifici: caricate alla prima richiesta
+sr = LazyModule("speech_recognition")
+pyttsx3 = LazyModule("pyttsx3")
+pd = LazyModule("pandas")
+go = LazyModule("plotly.graph_objects")
+pygame = LazyModule("pygame")
 
 # Configurazione logging
 logging.basicConfig(filename='object_detection.log', level=logging.INFO)
+DB_PATH = 'object_detection.db'
 # Definisci il dizionario object_uses
 object_uses = {
     "person": "Una persona può fare molte cose, come camminare, parlare, ecc.",
@@ -82,6 +142,601 @@ languages = {
 def get_object_use(obj_name):
     return object_uses.get(obj_name, "Non so a cosa serve questo oggetto.")
 
+# Configurazione per installazione, sovrascrivibile con rico_config.json senza modificare il codice
+CONFIG_PATH = 'rico_config.json'
+DEFAULT_CONFIG = {
+    "preprocess": {
+        "mode": "adaptive",            # "fixed" oppure "adaptive"
+        "size": 320,                   # Lato del letterbox quadrato usato per l'inferenza
+        "sizes": [256, 320, 416, 512, 640],
+        "target_latency_ms": 100       # Budget di latenza per chiamata al modello (modalità adaptive)
+    },
+    "motion": {
+        "enabled": True,
+        "thumbnail": [64, 36],         # Miniatura su cui si calcola la differenza
+        "pixel_threshold": 25,         # Variazione minima di un pixel (0-255) per considerarlo cambiato
+        "changed_fraction": 0.01,      # Frazione di pixel cambiati oltre cui si riesegue il modello
+        "refresh_s": 2.0               # Inferenza forzata comunque dopo questo intervallo
+    },
+    "governor": {
+        "max_fps": 30,                 # Catture massime al secondo per sorgente
+        "min_fps": 1,                  # Anche con un modello lento almeno questi frame al secondo al modello
+        "cpu_budget": 0.5,             # Frazione del tempo che il modello può occupare (1.0 = tutto il throughput)
+        "background_fps": 2,           # Limite con la finestra ridotta a icona
+        "alert_hold_s": 10.0           # Dopo un'allerta il modello gira alla massima velocità per questi secondi
+    },
+    "screen": {
+        "monitor": 0,                  # Indice mss: 0 = tutti i monitor, 1 = primo monitor, ...
+        "region": None,                # [left, top, width, height] per catturare solo una zona
+        "tile": 128,                   # Lato in pixel delle tessere su cui si cercano i cambiamenti
+        "tile_threshold": 12,          # Variazione media minima (0-255) di una tessera modificata
+        "max_dirty_fraction": 0.5,     # Oltre questa frazione di tessere si analizza tutto lo schermo
+        "max_regions": 4,              # Ritagli massimi inviati al modello per ogni cattura
+        "refresh_s": 2.0               # Analisi completa forzata comunque dopo questo intervallo
+    },
+    "tracking": {
+        "iou_threshold": 0.3,          # Sovrapposizione minima per associare un rilevamento a una traccia
+        "max_age_s": 1.0,              # Una traccia non più vista da questo tempo viene chiusa
+        "update_interval_s": 30.0      # Ogni quanto salvare una riga di aggiornamento per le tracce lunghe
+    },
+    "inference": {
+        "backend": "auto",             # "auto" sceglie il più veloce tra i candidati con un breve benchmark
+        "candidates": ["openvino", "onnxruntime-int8", "onnxruntime", "ultralytics"],
+        "weights": "yolov8n.pt",
+        "cache_dir": "models",         # Modelli esportati in ONNX e backend scelto dall'ultimo benchmark
+        "threads": 4,                  # Thread di calcolo per ONNX Runtime / OpenVINO
+        "confidence": 0.25,
+        "iou": 0.45,
+        "benchmark_runs": 5
+    },
+    "recording": {
+        "directory": "recordings",
+        "fourcc": "XVID",
+        "extension": "avi",
+        "fps": 20.0,                   # Cadenza dei file, i frame sono allineati ai loro timestamp
+        "segment_s": 300,              # Durata di ogni file prima di aprirne uno nuovo
+        "max_segments": 50,            # File tenuti nella cartella, i più vecchi vengono eliminati (0 = tutti)
+        "preroll_s": 5.0,              # Secondi salvati all'inizio delle clip, in memoria solo se una regola registra
+        "alert_clip_s": 10.0,          # Durata delle clip delle regole d'allerta dopo l'ultimo frame che le soddisfa
+        "preroll_quality": 80,         # Qualità JPEG dei frame del pre-roll
+        "queue_size": 64
+    },
+    "alerts": {
+        # Regole d'allerta, ad esempio:
+        # {"name": "porta", "label": "person", "min_confidence": 0.5, "sources": ["cam0"],
+        #  "zone": [[0.1, 0.2], [0.4, 0.2], [0.4, 0.9], [0.1, 0.9]], "dwell_s": 3, "cooldown_s": 60,
+        #  "record": true, "clip_s": 20, "sound": true}
+        # "record" è falso se non indicato. None = persona, coltello e fuoco ovunque nel frame,
+        # con clip registrate solo per coltello e fuoco
+        "rules": None
+    },
+    "roi": {
+        # Zone d'interesse per sorgente, poligoni in coordinate normalizzate 0-1 (Video > Disegna Zona)
+        "zones": {},
+        "padding": 0.15                # Margine attorno a ogni zona, in frazione del suo lato maggiore
+    },
+    "server": {
+        "enabled": False,              # Attivabile anche con --serve
+        "host": "127.0.0.1",
+        "port": 8765,
+        "jpeg_quality": 80,
+        "stream_width": 1280           # Larghezza massima dei frame MJPEG
+    }
+}
+
+def load_config(path=CONFIG_PATH):
+    """Unisce le sezioni del file JSON ai valori predefiniti"""
+    config = {section: dict(values) for section, values in DEFAULT_CONFIG.items()}
+    if os.path.exists(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                for section, values in json.load(f).items():
+                    if isinstance(values, dict):
+                        config.setdefault(section, {}).update(values)
+                    else:
+                        config[section] = values
+        except (OSError, ValueError) as e:
+            logging.error(f"Errore nella lettura di {path}: {e}")
+    return config
+
+def save_config_section(section, values, path=CONFIG_PATH):
+    """Aggiorna una sola sezione del file JSON lasciando invariate le altre"""
+    data = {}
+    try:
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        data[section] = values
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+    except (OSError, ValueError) as e:
+        logging.error(f"Errore nel salvataggio di {path}: {e}")
+
+def box_center_in(box, region):
+    """True se il centro del box cade nella zona (x1, y1, x2, y2)"""
+    cx, cy = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+    return region[0] <= cx < region[2] and region[1] <= cy < region[3]
+
+class RegionsOfInterest:
+    """Zone d'interesse per sorgente: i ritagli da inviare al modello e il filtro dei rilevamenti"""
+    def __init__(self, zones=None, padding=0.15):
+        self.zones = {source: [[tuple(point) for point in polygon] for polygon in polygons]
+                      for source, polygons in (zones or {}).items() if polygons}
+        self.padding = padding
+        self._cache = {}  # (sorgente, larghezza, altezza) -> (ritagli, poligoni in pixel)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(zones=config["zones"], padding=config["padding"])
+
+    def to_config(self):
+        return {"zones": {source: [[list(point) for point in polygon] for polygon in polygons]
+                          for source, polygons in self.zones.items()},
+                "padding": self.padding}
+
+    def add(self, source, polygon):
+        with self._lock:
+            self.zones.setdefault(source, []).append([tuple(point) for point in polygon])
+            self._cache.clear()
+
+    def clear(self, source=None):
+        with self._lock:
+            if source is None:
+                self.zones.clear()
+            else:
+                self.zones.pop(source, None)
+            self._cache.clear()
+
+    def _compiled(self, source, frame_size):
+        key = (source,) + tuple(frame_size)
+        compiled = self._cache.get(key)
+        if compiled is None:
+            with self._lock:
+                compiled = self._cache[key] = self._compile(self.zones.get(source, []), frame_size)
+        return compiled
+
+    def _compile(self, polygons, frame_size):
+        w, h = frame_size
+        pixel_polygons, crops = [], []
+        for polygon in polygons:
+            points = [(x * w, y * h) for x, y in polygon]
+            xs, ys = [x for x, _ in points], [y for _, y in points]
+            pad = self.padding * max(max(xs) - min(xs), max(ys) - min(ys))
+            crops.append([int(max(min(xs) - pad, 0)), int(max(min(ys) - pad, 0)),
+                          int(min(max(xs) + pad, w)), int(min(max(ys) + pad, h))])
+            pixel_polygons.append(points)
+        # I ritagli che si sovrappongono diventano uno solo, così un oggetto non viene rilevato due volte
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(crops)):
+                for j in range(i + 1, len(crops)):
+                    a, b = crops[i], crops[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        crops[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        del crops[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return [tuple(crop) for crop in crops if crop[2] > crop[0] and crop[3] > crop[1]], pixel_polygons
+
+    def crops(self, source, frame_size):
+        """Ritagli (x1, y1, x2, y2) con margine da analizzare; None se la sorgente non ha zone"""
+        if source not in self.zones:
+            return None
+        return self._compiled(source, frame_size)[0]
+
+    def contains(self, source, box, frame_size):
+        """True se il centro del box cade in una delle zone della sorgente"""
+        cx, cy = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+        return any(point_in_polygon(cx, cy, polygon) for polygon in self._compiled(source, frame_size)[1])
+
+class Preprocessor:
+    """Letterbox dei frame alla risoluzione di inferenza, fissa o adattiva rispetto a un budget di latenza"""
+    PAD_COLOR = (114, 114, 114)
+
+    def __init__(self, sizes=(256, 320, 416, 512, 640), size=320, mode="adaptive",
+                 target_latency=0.1, cooldown=10):
+        self.sizes = sorted(sizes)
+        self.size = min(self.sizes, key=lambda candidate: abs(candidate - size))
+        self.mode = mode
+        self.target_latency = target_latency
+        self.cooldown = cooldown  # Chiamate minime tra due cambi di risoluzione
+        self.latency = None  # Media mobile esponenziale della latenza del modello
+        self._calls_since_change = 0
+        # Buffer riusati tra un batch e l'altro, uno per posizione nel batch
+        self._canvases = {}
+        self._resized = {}
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(sizes=config["sizes"], size=config["size"], mode=config["mode"],
+                   target_latency=config["target_latency_ms"] / 1000.0)
+
+    def letterbox(self, frame, size=None, index=None):
+        """Ridimensiona mantenendo le proporzioni e riempie fino al quadrato size x size
+
+        Con index il risultato va in un buffer riusato per quella posizione del batch: resta valido
+        solo fino al prossimo letterbox con lo stesso indice.
+        """
+        size = size or self.size
+        h, w = frame.shape[:2]
+        scale = min(size / w, size / h)
+        new_w, new_h = max(1, int(round(w * scale))), max(1, int(round(h * scale)))
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        pad_x, pad_y = (size - new_w) // 2, (size - new_h) // 2
+        if index is None:
+            resized = cv2.resize(frame, (new_w, new_h), interpolation=interpolation)
+            image = cv2.copyMakeBorder(resized, pad_y, size - new_h - pad_y, pad_x, size - new_w - pad_x,
+                                       cv2.BORDER_CONSTANT, value=self.PAD_COLOR)
+            return image, (scale, pad_x, pad_y)
+
+        canvas = self._canvases.get((index, size))
+        if canvas is None:
+            canvas = self._canvases[(index, size)] = np.empty((size, size, 3), dtype=np.uint8)
+        # cv2 riusa dst se ha già la dimensione giusta, altrimenti ne alloca uno nuovo che si tiene
+        resized = self._resized[index] = cv2.resize(frame, (new_w, new_h), dst=self._resized.get(index),
+                                                    interpolation=interpolation)
+        canvas[:] = self.PAD_COLOR
+        canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = resized
+        return canvas, (scale, pad_x, pad_y)
+
+    @staticmethod
+    def map_box(box, transform, frame_shape):
+        """Riporta un box dalle coordinate del letterbox a quelle del frame originale"""
+        scale, pad_x, pad_y = transform
+        h, w = frame_shape[:2]
+        x1, y1, x2, y2 = box
+        return (
+            int(min(max((x1 - pad_x) / scale, 0), w - 1)),
+            int(min(max((y1 - pad_y) / scale, 0), h - 1)),
+            int(min(max((x2 - pad_x) / scale, 0), w - 1)),
+            int(min(max((y2 - pad_y) / scale, 0), h - 1))
+        )
+
+    def record_latency(self, seconds):
+        """Aggiorna la latenza misurata e, in modalità adattiva, sposta la risoluzione"""
+        self.latency = seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+        self._calls_since_change += 1
+        if self.mode != "adaptive" or self._calls_since_change < self.cooldown:
+            return
+        index = self.sizes.index(self.size)
+        if self.latency > self.target_latency * 1.1 and index > 0:
+            self._set_size(self.sizes[index - 1])
+        elif self.latency < self.target_latency * 0.6 and index < len(self.sizes) - 1:
+            self._set_size(self.sizes[index + 1])
+
+    def _set_size(self, size):
+        logging.info(f"Risoluzione di inferenza {self.size} -> {size} (latenza {self.latency * 1000:.0f} ms)")
+        # La latenza attesa scala circa con il numero di pixel
+        self.latency *= (size / self.size) ** 2
+        self.size = size
+        self._calls_since_change = 0
+
+class MotionGate:
+    """Salta l'inferenza sui frame statici confrontando miniature in scala di grigi"""
+    def __init__(self, enabled=True, thumbnail=(64, 36), pixel_threshold=25, changed_fraction=0.01,
+                 refresh_interval=2.0):
+        self.enabled = enabled
+        self.thumbnail = tuple(thumbnail)
+        self.pixel_threshold = pixel_threshold
+        self.changed_fraction = changed_fraction
+        self.refresh_interval = refresh_interval
+        self._references = {}  # sorgente -> (miniatura all'ultima inferenza, istante)
+        self.skipped = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(enabled=config["enabled"], thumbnail=config["thumbnail"],
+                   pixel_threshold=config["pixel_threshold"], changed_fraction=config["changed_fraction"],
+                   refresh_interval=config["refresh_s"])
+
+    def should_infer(self, source, frame, now):
+        """False se il frame è quasi identico a quello dell'ultima inferenza della stessa sorgente"""
+        if not self.enabled:
+            return True
+        # Prima riduce e poi converte, così il costo non dipende dalla risoluzione
+        thumb = cv2.cvtColor(cv2.resize(frame, self.thumbnail, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        reference = self._references.get(source)
+        if reference is not None and now - reference[1] < self.refresh_interval:
+            diff = cv2.absdiff(thumb, reference[0])
+            if np.count_nonzero(diff > self.pixel_threshold) < self.changed_fraction * diff.size:
+                self.skipped += 1
+                return False
+        # Il riferimento resta quello dell'ultima inferenza, così anche i cambi lenti si accumulano
+        self._references[source] = (thumb, now)
+        return True
+
+    def reset(self, source=None):
+        if source is None:
+            self._references.clear()
+        else:
+            self._references.pop(source, None)
+
+class FrameRateGovernor:
+    """Ritmo del modello: segue il suo throughput misurato entro un budget di CPU
+
+    Le catture seguono la camera; tra due frame inviati al modello il tracker interpola le posizioni.
+    """
+    def __init__(self, max_fps=30, min_fps=1, cpu_budget=0.5, background_fps=2, alert_hold_s=10.0):
+        self.max_fps = max_fps
+        self.min_fps = min_fps
+        self.cpu_budget = cpu_budget
+        self.background_fps = background_fps
+        self.alert_hold_s = alert_hold_s
+        self.latency = None  # Media mobile della durata di un batch del modello
+        self.background = False  # Finestra ridotta a icona: nessuno guarda il video
+        self._last_alert = float("-inf")
+        self._next_inference = {}  # sorgente -> istante (monotonic) del prossimo frame per il modello
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(**config)
+
+    def record_inference(self, seconds):
+        self.latency = seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+
+    def alert(self):
+        self._last_alert = time.monotonic()
+
+    def _alerting(self):
+        return time.monotonic() - self._last_alert < self.alert_hold_s
+
+    def capture_interval(self):
+        """Secondi tra due catture della stessa sorgente: il video mostrato segue la camera"""
+        if self.background and not self._alerting():
+            return 1.0 / self.background_fps
+        return 1.0 / self.max_fps
+
+    def should_infer(self, source, now):
+        """True se il frame catturato ora va al modello, altrimenti basta il tracker"""
+        if now < self._next_inference.get(source, 0.0):
+            return False
+        self._next_inference[source] = now + self.interval()
+        return True
+
+    def interval(self):
+        """Secondi tra due frame della stessa sorgente inviati al modello"""
+        latency = self.latency or 0.0
+        if self._alerting():
+            # Allerta in corso: tutto il throughput del modello, il budget non conta
+            return max(1.0 / self.max_fps, latency)
+        # Ogni batch serve un frame per sorgente: inviarne più spesso vorrebbe dire scartarli in coda
+        interval = max(1.0 / self.max_fps, latency / self.cpu_budget)
+        if self.background:
+            interval = max(interval, 1.0 / self.background_fps)
+        return min(interval, 1.0 / self.min_fps)
+
+class ScreenCapture:
+    """Sessione mss persistente che cattura un monitor o una zona e individua le tessere modificate"""
+    SAMPLES_PER_TILE = 4  # Campioni per lato usati per stimare il cambiamento di una tessera
+
+    def __init__(self, monitor=0, region=None, tile=128, tile_threshold=12, max_dirty_fraction=0.5,
+                 max_regions=4, refresh_s=2.0):
+        self.tile = tile
+        self.tile_threshold = tile_threshold
+        self.max_dirty_fraction = max_dirty_fraction
+        self.max_regions = max_regions
+        self.refresh_interval = refresh_s
+        self._sct = mss.mss()
+        if region:
+            left, top, width, height = region
+            self.area = {"left": left, "top": top, "width": width, "height": height}
+        else:
+            self.area = self._sct.monitors[monitor]
+        width, height = self.area["width"], self.area["height"]
+        self.cols = -(-width // tile)
+        self.rows = -(-height // tile)
+        self._sample_size = (self.cols * self.SAMPLES_PER_TILE, self.rows * self.SAMPLES_PER_TILE)
+        self._previous = None  # Miniatura dell'ultima cattura inviata al modello, riferimento per le differenze
+        self._candidate = None  # (miniatura, istante del refresh completo o None) dell'ultima grab, vedi commit
+        self._diff = None
+        self._last_full = 0.0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(**config)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._sct.close()
+
+    def grab(self, out=None):
+        """Restituisce (frame BGR, zone modificate): zone None = analizzare tutto, [] = nulla di nuovo"""
+        # mss crea comunque un ScreenShot nuovo a ogni cattura; la sessione riusa solo connessione e contesto
+        shot = self._sct.grab(self.area)
+        # Vista senza copia su shot.raw (shot.bgra sarebbe bytes(raw), una copia intera del frame);
+        # la sola copia è la conversione in BGR, in out se dato
+        bgra = np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+        frame = cv2.cvtColor(bgra, cv2.COLOR_BGRA2BGR, dst=out)
+        return frame, self._dirty_regions(bgra)
+
+    def commit(self):
+        """L'ultima cattura è andata al modello: diventa il riferimento per le zone modificate
+
+        Una cattura che il governor non inoltra non deve spostare il riferimento,
+        altrimenti il cambiamento che conteneva andrebbe perso fino al prossimo refresh.
+        """
+        if self._candidate is None:
+            return
+        sample, full = self._candidate
+        self._previous = sample
+        if full is not None:
+            self._last_full = full
+        self._candidate = None
+
+    def _dirty_regions(self, bgra):
+        sample = cv2.cvtColor(cv2.resize(bgra, self._sample_size, interpolation=cv2.INTER_AREA),
+                              cv2.COLOR_BGRA2GRAY)
+        previous = self._previous
+        now = time.monotonic()
+        self._candidate = (sample, None)
+        if previous is None or now - self._last_full >= self.refresh_interval:
+            self._candidate = (sample, now)
+            return None
+
+        self._diff = cv2.absdiff(sample, previous, dst=self._diff)
+        n = self.SAMPLES_PER_TILE
+        tile_change = self._diff.reshape(self.rows, n, self.cols, n).mean(axis=(1, 3))
+        dirty = (tile_change > self.tile_threshold).astype(np.uint8)
+        dirty_count = int(dirty.sum())
+        if dirty_count == 0:
+            return []
+        if dirty_count > self.max_dirty_fraction * dirty.size:
+            self._candidate = (sample, now)
+            return None
+
+        # Un ritaglio per ogni gruppo di tessere adiacenti, con una tessera di margine
+        count, _, stats, _ = cv2.connectedComponentsWithStats(dirty, connectivity=8)
+        boxes = [stats[i][:4] for i in range(1, count)]
+        if len(boxes) > self.max_regions:
+            ys, xs = np.nonzero(dirty)
+            boxes = [(xs.min(), ys.min(), xs.max() - xs.min() + 1, ys.max() - ys.min() + 1)]
+        width, height = self.area["width"], self.area["height"]
+        regions = []
+        for col, row, cols, rows in boxes:
+            regions.append((
+                int(max(col - 1, 0) * self.tile),
+                int(max(row - 1, 0) * self.tile),
+                int(min((col + cols + 1) * self.tile, width)),
+                int(min((row + rows + 1) * self.tile, height))
+            ))
+        return regions
+
+def box_iou(a, b):
+    """Intersection over union di due box (x1, y1, x2, y2)"""
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    intersection = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+class Track:
+    """Oggetto seguito tra i frame, con velocità stimata per interpolare la posizione"""
+    MAX_PREDICTION = 0.5  # Secondi oltre cui non si estrapola più il movimento
+
+    def __init__(self, track_id, detection, now):
+        self.track_id = track_id
+        self.label = detection["label"]
+        self.confidence = detection["confidence"]
+        self.box = tuple(detection["box"])
+        self.velocity = (0.0, 0.0, 0.0, 0.0)  # Pixel al secondo per ciascuna coordinata
+        self.first_seen = now
+        self.last_seen = now
+        self.last_saved = now
+
+    def predict(self, now):
+        dt = min(now - self.last_seen, self.MAX_PREDICTION)
+        return tuple(int(c + v * dt) for c, v in zip(self.box, self.velocity))
+
+    def update(self, detection, now):
+        box = tuple(detection["box"])
+        dt = now - self.last_seen
+        if dt > 0:
+            # Filtro alfa-beta: media tra velocità stimata e velocità misurata
+            measured = [(new - old) / dt for new, old in zip(box, self.box)]
+            self.velocity = tuple(v + 0.5 * (m - v) for v, m in zip(self.velocity, measured))
+        self.box = box
+        self.confidence = max(self.confidence, detection["confidence"])
+        self.last_seen = now
+
+    def as_detection(self, box=None, event=None):
+        return {
+            "label": self.label,
+            "confidence": self.confidence,
+            "box": box or self.box,
+            "track_id": self.track_id,
+            "event": event
+        }
+
+class ObjectTracker:
+    """Associa i rilevamenti tra frame successivi (IoU sul box previsto) e assegna id persistenti"""
+    _ids = 0
+    _ids_lock = threading.Lock()
+
+    def __init__(self, iou_threshold=0.3, max_age=1.0, update_interval=30.0):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.update_interval = update_interval
+        self.tracks = {}
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(iou_threshold=config["iou_threshold"], max_age=config["max_age_s"],
+                   update_interval=config["update_interval_s"])
+
+    @classmethod
+    def continue_ids(cls, last_id):
+        """Riparte dopo l'ultimo id salvato, così gli id non si ripetono tra sessioni e --batch"""
+        with cls._ids_lock:
+            cls._ids = max(cls._ids, last_id or 0)
+
+    @classmethod
+    def _next_id(cls):
+        # Id univoci tra tutte le sorgenti e le sessioni, così nel database non si confondono
+        with cls._ids_lock:
+            cls._ids += 1
+            return cls._ids
+
+    def update(self, detections, now):
+        """Restituisce (rilevamenti con track_id, eventi da salvare)"""
+        predicted = {track_id: track.predict(now) for track_id, track in self.tracks.items()}
+        pairs = []
+        for index, det in enumerate(detections):
+            for track_id, box in predicted.items():
+                if self.tracks[track_id].label != det["label"]:
+                    continue
+                iou = box_iou(det["box"], box)
+                if iou >= self.iou_threshold:
+                    pairs.append((iou, index, track_id))
+
+        # Associazione greedy a partire dalle sovrapposizioni migliori
+        events = []
+        matched_detections, matched_tracks = set(), set()
+        for _, index, track_id in sorted(pairs, reverse=True):
+            if index in matched_detections or track_id in matched_tracks:
+                continue
+            matched_detections.add(index)
+            matched_tracks.add(track_id)
+            track = self.tracks[track_id]
+            track.update(detections[index], now)
+            if now - track.last_saved >= self.update_interval:
+                track.last_saved = now
+                events.append(track.as_detection(event="update"))
+
+        for index, det in enumerate(detections):
+            if index not in matched_detections:
+                track = Track(self._next_id(), det, now)
+                self.tracks[track.track_id] = track
+                matched_tracks.add(track.track_id)
+                events.append(track.as_detection(event="start"))
+
+        for track_id in list(self.tracks):
+            if track_id not in matched_tracks and now - self.tracks[track_id].last_seen > self.max_age:
+                events.append(self.tracks.pop(track_id).as_detection(event="end"))
+
+        active = [self.tracks[track_id].as_detection() for track_id in matched_tracks]
+        return active, events
+
+    def predict(self, now):
+        """Posizioni interpolate delle tracce attive, per i frame su cui il modello non gira"""
+        # Chiamato dai thread di cattura mentre l'inferenza aggiorna le tracce: si itera su una copia
+        return [track.as_detection(box=track.predict(now)) for track in list(self.tracks.values())
+                if now - track.last_seen <= self.max_age]
+
+    def close(self):
+        """Chiude tutte le tracce aperte, ad esempio quando la sorgente si ferma"""
+        events = [track.as_detection(event="end") for track in self.tracks.values()]
+        self.tracks.clear()
+        return events
+
 class RoundedButton(tk.Canvas):
     def __init__(self, parent, text, command, width=200, height=40, corner_radius=10, **kwargs):
         super().__init__(parent, width=width, height=height, 
@@ -133,10 +788,1497 @@ class RoundedButton(tk.Canvas):
         if self.command:
             self.command()
 
+class StageStats:
+    """Istogramma cumulativo di uno stadio più una finestra degli ultimi campioni per i percentili"""
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)  # Secondi
+
+    def __init__(self, window=512):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        self.recent.append(seconds)
+
+    def percentile(self, q):
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+class PipelineMetrics:
+    """Tempi per stadio, contatori e profondità delle code, per l'overlay e per l'endpoint /metrics"""
+    def __init__(self):
+        self.stages = {}
+        self._series = []  # (tipo, nome, descrizione, etichette, funzione letta solo quando servono i valori)
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = StageStats()
+            stats.observe(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def register(self, kind, name, description, labels, func):
+        """Contatore o gauge calcolato da func: nessun costo sul percorso dei frame"""
+        self._series.append((kind, name, description, labels, func))
+
+    def _values(self):
+        values = []
+        for kind, name, description, labels, func in list(self._series):
+            try:
+                values.append((kind, name, description, labels, func()))
+            except Exception as e:
+                logging.error(f"Errore nella lettura della metrica {name}: {e}")
+        return values
+
+    def overlay_lines(self):
+        """Righe brevi per l'overlay sul video"""
+        with self._lock:
+            stages = [(name, stats.percentile(0.5), stats.percentile(0.95)) for name, stats in self.stages.items()]
+        lines = [f"{name:<14} p50 {p50 * 1000:6.1f} ms  p95 {p95 * 1000:6.1f} ms" for name, p50, p95 in stages]
+        groups = {"rico_frames_dropped_total": [], "rico_queue_depth": [], None: []}
+        for _, name, _, labels, value in self._values():
+            label = ",".join(str(v) for v in labels.values()) or name.replace("rico_", "")
+            groups.get(name, groups[None]).append(f"{label} {value}")
+        for title, key in (("scartati", "rico_frames_dropped_total"), ("code", "rico_queue_depth"), ("altro", None)):
+            if groups[key]:
+                lines.append(f"{title}: " + "  ".join(groups[key]))
+        return lines
+
+    def render(self):
+        """Metriche in formato testo Prometheus"""
+        lines = ["# HELP rico_stage_seconds Durata degli stadi della pipeline",
+                 "# TYPE rico_stage_seconds histogram"]
+        with self._lock:
+            snapshot = [(name, list(stats.counts), stats.sum, stats.count) for name, stats in self.stages.items()]
+        for name, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket in zip(StageStats.BUCKETS + (float("inf"),), counts):
+                cumulative += bucket
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'rico_stage_seconds_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'rico_stage_seconds_sum{{stage="{name}"}} {total:.6f}')
+            lines.append(f'rico_stage_seconds_count{{stage="{name}"}} {count}')
+        described = set()
+        # Le serie con lo stesso nome devono stare una di seguito all'altra
+        for kind, name, description, labels, value in sorted(self._values(), key=lambda series: series[1]):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {kind}")
+            label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+class LatestFrameQueue:
+    """Coda limitata con politica "vince l'ultimo frame": se piena scarta il più vecchio"""
+    def __init__(self, maxsize=1, on_drop=None):
+        self.maxsize = maxsize
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.on_drop = on_drop  # Chiamata con ogni elemento scartato
+        self.dropped = 0
+
+    def put(self, item):
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                # Scarta l'elemento più vecchio così il produttore non resta mai in attesa
+                try:
+                    self._drop(self._queue.get_nowait())
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _drop(self, item):
+        if self.on_drop is not None:
+            self.on_drop(item)
+
+    def get(self, timeout=None):
+        return self._queue.get(timeout=timeout)
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def clear(self):
+        while True:
+            try:
+                self._drop(self._queue.get_nowait())
+            except queue.Empty:
+                return
+
+def shm_free_bytes():
+    """Spazio libero in /dev/shm, None dove non esiste (Windows, macOS)"""
+    try:
+        stat = os.statvfs("/dev/shm")
+    except (AttributeError, OSError):
+        return None
+    return stat.f_bavail * stat.f_frsize
+
+class FrameRing:
+    """Slot preallocati in memoria condivisa per i frame di una sorgente, riusati invece di allocarne di nuovi"""
+    def __init__(self, shape, slots):
+        # slots viene da FramePipeline.frames_in_flight: uno per ogni frame che la pipeline può trattenere
+        self.shape = tuple(shape)
+        self.slots = slots
+        size = slots * int(np.prod(self.shape))
+        self.shm = None
+        try:
+            # La memoria condivisa non viene riservata alla creazione: con /dev/shm piccola (Docker ha 64 MB)
+            # la prima scrittura darebbe SIGBUS, quindi lo spazio si controlla prima
+            free = shm_free_bytes()
+            if free is not None and free < size:
+                raise OSError(f"{size // 2**20} MB richiesti, {free // 2**20} MB liberi in /dev/shm")
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        except OSError as e:
+            logging.info(f"Ring dei frame in memoria privata: {e}")
+        if self.shm is not None:
+            self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=self.shm.buf)
+        else:
+            self.frames = np.empty((slots,) + self.shape, dtype=np.uint8)
+        self._free = deque(range(slots))
+        self._lock = threading.Lock()
+        self.exhausted = 0  # Frame allocati a parte perché tutti gli slot erano in uso
+
+    def acquire(self):
+        """Indice di uno slot libero, None se sono tutti ancora nella pipeline"""
+        with self._lock:
+            if not self._free:
+                self.exhausted += 1
+                return None
+            return self._free.popleft()
+
+    def release(self, index):
+        with self._lock:
+            self._free.append(index)
+
+    def view(self, index):
+        return self.frames[index]
+
+    def close(self):
+        self.frames = None
+        if self.shm is None:
+            return
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # Qualche pacchetto ha ancora una vista: la mappatura resta finché non viene liberata
+        self.shm.unlink()
+
+class FramePacket:
+    """Frame in transito nella pipeline con i risultati accumulati dagli stadi"""
+    def __init__(self, frame, source="webcam", ring=None, slot=None):
+        self.frame = frame
+        self.source = source
+        # Slot del ring da cui proviene il frame, restituito quando il pacchetto esce dalla pipeline
+        self.ring = ring
+        self.slot = slot
+        self.timestamp = time.time()
+        self.detections = []
+        self.image = None
+        # Zone (x1, y1, x2, y2) da analizzare; None = frame intero
+        self.regions = None
+        # Se True i rilevamenti precedenti fuori dalle zone restano validi
+        self.partial = False
+
+    def absorb(self, older):
+        """Eredita le zone di un pacchetto più vecchio della stessa sorgente che viene scartato"""
+        if not self.partial:
+            return
+        if older.partial:
+            self.regions = older.regions + self.regions
+        else:
+            self.regions = None
+            self.partial = False
+
+    def release(self):
+        """Restituisce lo slot al ring: da qui in poi frame può essere riscritto dalla cattura"""
+        if self.ring is not None:
+            self.ring.release(self.slot)
+            self.ring = None
+
+class InferenceScheduler:
+    """Raccoglie i frame di tutte le sorgenti attive in micro-batch per una sola chiamata al modello"""
+    def __init__(self, infer_batch, on_result, max_batch=4, max_wait=0.02, source_timeout=1.0):
+        self.infer_batch = infer_batch
+        self.on_result = on_result
+        self.max_batch = max_batch
+        self.max_wait = max_wait  # Attesa massima prima di inviare un batch incompleto (secondi)
+        self.source_timeout = source_timeout
+        self._pending = {}  # sorgente -> ultimo pacchetto (vince l'ultimo frame per sorgente)
+        self._last_seen = {}
+        self._cond = threading.Condition()
+        self.dropped = 0
+        self.running = False
+        self._thread = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._thread = threading.Thread(target=self._loop, name="rico-inferenza", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+        with self._cond:
+            for packet in self._pending.values():
+                packet.release()
+            self._pending.clear()
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def submit(self, packet):
+        with self._cond:
+            older = self._pending.get(packet.source)
+            if older is not None:
+                self.dropped += 1
+                # Le zone modificate del frame scartato non devono andare perse
+                packet.absorb(older)
+                older.release()
+            self._pending[packet.source] = packet
+            self._last_seen[packet.source] = time.monotonic()
+            self._cond.notify()
+
+    def depth(self):
+        return len(self._pending)
+
+    def _active_sources(self, now):
+        return sum(1 for seen in self._last_seen.values() if now - seen < self.source_timeout)
+
+    def _next_batch(self):
+        with self._cond:
+            if not self._pending:
+                self._cond.wait(timeout=0.1)
+                if not self._pending:
+                    return []
+            # Attende gli altri sorgenti attivi fino alla scadenza del batch
+            deadline = time.monotonic() + self.max_wait
+            while self.running:
+                now = time.monotonic()
+                wanted = min(self.max_batch, max(1, self._active_sources(now)))
+                if len(self._pending) >= wanted or now >= deadline:
+                    break
+                self._cond.wait(timeout=deadline - now)
+            sources = list(self._pending)[:self.max_batch]
+            return [self._pending.pop(source) for source in sources]
+
+    def _loop(self):
+        while self.running:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                results = self.infer_batch(batch)
+            except Exception as e:
+                logging.error(f"Errore durante l'inferenza a batch: {e}")
+                for packet in batch:
+                    packet.release()
+                continue
+            # Smista i risultati verso lo stadio successivo di ciascuna sorgente
+            for packet in results:
+                self.on_result(packet)
+
+class FramePipeline:
+    """Pipeline cattura -> inferenza -> annotazione -> visualizzazione, uno stadio per thread"""
+    def __init__(self, infer_batch, annotate, display, queue_size=1, max_batch=4, max_wait=0.02, metrics=None):
+        self.metrics = metrics
+        self.stages = [
+            ("annotazione", annotate, LatestFrameQueue(queue_size, on_drop=FramePacket.release)),
+            ("visualizzazione", display, LatestFrameQueue(queue_size, on_drop=FramePacket.release))
+        ]
+        # L'inferenza è condivisa da tutte le sorgenti tramite lo scheduler a batch
+        self.scheduler = InferenceScheduler(infer_batch, self.stages[0][2].put,
+                                            max_batch=max_batch, max_wait=max_wait)
+        self.running = False
+        self._threads = []
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.scheduler.start()
+        self._threads = []
+        for index, (name, func, in_queue) in enumerate(self.stages):
+            out_queue = self.stages[index + 1][2] if index + 1 < len(self.stages) else None
+            thread = threading.Thread(target=self._stage_loop, args=(name, func, in_queue, out_queue),
+                                      name=f"rico-{name}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self.running = False
+        self.scheduler.stop()
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+        self._threads = []
+        for _, _, stage_queue in self.stages:
+            stage_queue.clear()
+
+    def frames_in_flight(self):
+        """Frame che una sorgente può avere contemporaneamente nella pipeline, cattura compresa"""
+        # Uno in cattura, uno in attesa nello scheduler, uno nel modello;
+        # per ogni stadio la coda più il frame in lavorazione
+        return 3 + sum(stage_queue.maxsize + 1 for _, _, stage_queue in self.stages)
+
+    def submit(self, packet):
+        """Consegna un frame allo scheduler di inferenza senza mai bloccare la cattura"""
+        self.scheduler.submit(packet)
+
+    def bypass(self, packet):
+        """Consegna un frame già provvisto di rilevamenti direttamente all'annotazione"""
+        self.stages[0][2].put(packet)
+
+    def _stage_loop(self, name, func, in_queue, out_queue):
+        while self.running:
+            try:
+                packet = in_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            start = time.perf_counter()
+            try:
+                result = func(packet)
+            except Exception as e:
+                logging.error(f"Errore nello stadio di {name}: {e}")
+                result = None
+            if self.metrics is not None:
+                self.metrics.observe(name, time.perf_counter() - start)
+            if result is not None and out_queue is not None:
+                out_queue.put(result)
+            else:
+                # Il pacchetto esce dalla pipeline: il suo slot torna libero per la cattura
+                packet.release()
+
+class UIDispatcher:
+    """Ponte thread-safe verso Tk: i worker accodano, un unico pump root.after applica sul thread Tk"""
+    def __init__(self, root, render_frame, interval_ms=16):
+        self.root = root
+        self.render_frame = render_frame
+        self.interval_ms = interval_ms  # ~60 Hz, la frequenza di aggiornamento del display
+        self._lock = threading.Lock()
+        self._frames = {}  # sorgente -> ultimo pacchetto, i frame intermedi vengono fusi
+        self._calls = deque()
+        self.merged = 0
+        self.metrics = None  # PipelineMetrics facoltative: tempo speso sul thread Tk per ogni frame
+        self._pump_id = None
+
+    def start(self):
+        if self._pump_id is None:
+            self._pump_id = self.root.after(self.interval_ms, self._pump)
+
+    def stop(self):
+        if self._pump_id is not None:
+            self.root.after_cancel(self._pump_id)
+            self._pump_id = None
+
+    def post_frame(self, packet):
+        """Chiamabile da qualsiasi thread: sostituisce il frame non ancora mostrato della stessa sorgente"""
+        with self._lock:
+            if packet.source in self._frames:
+                self.merged += 1
+            self._frames[packet.source] = packet
+
+    def call(self, func, *args):
+        """Chiamabile da qualsiasi thread: esegue func sul thread Tk al prossimo giro del pump"""
+        self._calls.append((func, args))
+
+    def _pump(self):
+        with self._lock:
+            packets = list(self._frames.values())
+            self._frames.clear()
+        for packet in packets:
+            start = time.perf_counter()
+            try:
+                self.render_frame(packet)
+            except Exception as e:
+                logging.error(f"Errore durante l'aggiornamento dell'interfaccia: {e}")
+            if self.metrics is not None:
+                self.metrics.observe("interfaccia", time.perf_counter() - start)
+        while self._calls:
+            func, args = self._calls.popleft()
+            try:
+                func(*args)
+            except Exception as e:
+                logging.error(f"Errore durante l'aggiornamento dell'interfaccia: {e}")
+        self._pump_id = self.root.after(self.interval_ms, self._pump)
+
+# Schema del database: timestamp interi (epoch), indici e tabelle di aggregazione
+SCHEMA_VERSION = 4
+ROLLUP_TABLES = (
+    ("detections_minute", 60),
+    ("detections_hour", 3600),
+    ("detections_day", None)  # Il giorno segue la mezzanotte locale
+)
+
+@lru_cache(maxsize=4096)
+def local_day_bucket(minute_bucket):
+    """Epoch della mezzanotte locale del giorno che contiene il minuto indicato"""
+    day = time.localtime(minute_bucket)
+    return int(time.mktime((day.tm_year, day.tm_mon, day.tm_mday, 0, 0, 0, 0, 0, -1)))
+
+def rollup_bucket(ts, size):
+    minute = ts - ts % 60
+    return local_day_bucket(minute) if size is None else ts - ts % size
+
+def init_schema(conn):
+    """Crea lo schema e migra la vecchia tabella (timestamp TEXT, object TEXT) se presente"""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(detections)")]
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    with conn:
+        legacy = "timestamp" in columns
+        if legacy:
+            conn.execute("ALTER TABLE detections RENAME TO detections_legacy")
+        conn.execute('''CREATE TABLE IF NOT EXISTS detections
+                        (ts INTEGER NOT NULL, object TEXT NOT NULL, confidence REAL,
+                         x1 INTEGER, y1 INTEGER, x2 INTEGER, y2 INTEGER, source TEXT,
+                         track_id INTEGER, event TEXT)''')
+        # Versione 2: ogni riga è un evento di una traccia (start, update, end)
+        if columns and not legacy and "track_id" not in columns:
+            conn.execute("ALTER TABLE detections ADD COLUMN track_id INTEGER")
+            conn.execute("ALTER TABLE detections ADD COLUMN event TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_detections_object_ts ON detections (object, ts)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_detections_ts ON detections (ts)")
+        # Per ripartire dall'ultimo id di traccia senza leggere tutta la tabella
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_detections_track_id ON detections (track_id)")
+        for table, _ in ROLLUP_TABLES:
+            conn.execute(f'''CREATE TABLE IF NOT EXISTS {table}
+                            (bucket INTEGER NOT NULL, object TEXT NOT NULL, count INTEGER NOT NULL,
+                             PRIMARY KEY (bucket, object)) WITHOUT ROWID''')
+        # Versione 3: checkpoint delle statistiche in memoria, inizializzato dallo storico
+        has_live_stats = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'live_stats'").fetchone()
+        conn.execute('''CREATE TABLE IF NOT EXISTS live_stats
+                        (object TEXT PRIMARY KEY, total INTEGER NOT NULL, first_seen INTEGER,
+                         last_seen INTEGER, peak_concurrent INTEGER NOT NULL DEFAULT 0)''')
+        if legacy:
+            # I vecchi timestamp erano in ora locale: 'utc' li converte in epoch corretti
+            conn.execute('''INSERT INTO detections (ts, object, source)
+                            SELECT CAST(strftime('%s', timestamp, 'utc') AS INTEGER), object, 'legacy'
+                            FROM detections_legacy WHERE timestamp IS NOT NULL''')
+            conn.execute("DROP TABLE detections_legacy")
+            rebuild_rollups(conn)
+        # Versione 4: i totali li aggiorna chi scrive le righe; si ricalcolano quelli persi dalle scritture di --batch
+        if not has_live_stats or version < 4:
+            conn.execute('''INSERT INTO live_stats (object, total, first_seen, last_seen)
+                            SELECT object, SUM(event IS NULL OR event = 'start'), MIN(ts), MAX(ts)
+                            FROM detections WHERE true GROUP BY object
+                            ON CONFLICT (object) DO UPDATE SET total = excluded.total,
+                            first_seen = excluded.first_seen, last_seen = excluded.last_seen''')
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+def counts_in_rollups(event):
+    """Le aggregazioni contano gli oggetti comparsi: inizi di traccia e righe senza tracciamento"""
+    return event is None or event == "start"
+
+def rebuild_rollups(conn):
+    """Ricalcola da zero le tabelle di aggregazione a partire da detections"""
+    for table, size in ROLLUP_TABLES:
+        conn.execute(f"DELETE FROM {table}")
+        if size is None:
+            bucket = "CAST(strftime('%s', date(ts, 'unixepoch', 'localtime'), 'utc') AS INTEGER)"
+        else:
+            bucket = f"ts - ts % {size}"
+        conn.execute(f'''INSERT INTO {table} (bucket, object, count)
+                         SELECT {bucket} AS b, object, COUNT(*) FROM detections
+                         WHERE event IS NULL OR event = 'start'
+                         GROUP BY b, object''')
+
+# Colonne di una riga di rilevamento, nello stesso ordine per database, CSV e Parquet
+ROW_COLUMNS = ("ts", "object", "confidence", "x1", "y1", "x2", "y2", "source", "track_id", "event")
+
+def detection_rows(detections, source, ts):
+    return [
+        (int(ts), det["label"], det["confidence"], *det["box"], source, det.get("track_id"), det.get("event"))
+        for det in detections
+    ]
+
+class DetectionWriter:
+    """Scrittore SQLite in background: possiede la propria connessione e salva a blocchi in modalità WAL"""
+    INSERT_SQL = ("INSERT INTO detections (ts, object, confidence, x1, y1, x2, y2, source, track_id, event) "
+                  "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+    ROLLUP_SQL = ("INSERT INTO {table} (bucket, object, count) VALUES (?, ?, ?) "
+                  "ON CONFLICT (bucket, object) DO UPDATE SET count = count + excluded.count")
+    LIVE_STATS_SQL = ("INSERT INTO live_stats (object, total, first_seen, last_seen) VALUES (?, ?, ?, ?) "
+                      "ON CONFLICT (object) DO UPDATE SET total = total + excluded.total, "
+                      "first_seen = COALESCE(MIN(first_seen, excluded.first_seen), first_seen, excluded.first_seen), "
+                      "last_seen = MAX(COALESCE(last_seen, excluded.last_seen), excluded.last_seen)")
+
+    def __init__(self, db_path, batch_size=500, flush_interval=1.0, metrics=None):
+        self.db_path = db_path
+        self.metrics = metrics
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval  # Intervallo massimo tra due transazioni (secondi)
+        self._buffer = []
+        self.version = 0  # Aumenta a ogni transazione riuscita, per invalidare le cache delle statistiche
+        self._checkpoints = []  # [funzione(conn), intervallo, ultimo istante], eseguite su questo thread
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self.running = False
+        self._thread = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._thread = threading.Thread(target=self._loop, name="rico-db", daemon=True)
+        self._thread.start()
+
+    def add(self, rows):
+        """Chiamabile da qualsiasi thread, non tocca mai il disco"""
+        with self._lock:
+            self._buffer.extend(rows)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def pending(self):
+        return len(self._buffer)
+
+    def add_checkpoint(self, func, interval):
+        """Esegue func(conn) ogni interval secondi e alla chiusura, con la connessione del writer"""
+        self._checkpoints.append([func, interval, time.monotonic()])
+
+    def _run_checkpoints(self, conn, force=False):
+        now = time.monotonic()
+        for checkpoint in self._checkpoints:
+            func, interval, last = checkpoint
+            if force or now - last >= interval:
+                checkpoint[2] = now
+                try:
+                    with conn:
+                        func(conn)
+                except sqlite3.Error as e:
+                    logging.error(f"Errore durante il checkpoint delle statistiche: {e}")
+
+    def close(self):
+        """Svuota il buffer su disco e chiude la connessione"""
+        if not self.running:
+            return
+        self.running = False
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+
+    def _loop(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # In WAL basta un fsync per checkpoint
+        try:
+            while self.running:
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                self._flush(conn)
+                self._run_checkpoints(conn)
+            self._flush(conn)
+            self._run_checkpoints(conn, force=True)
+        finally:
+            conn.close()
+
+    def _flush(self, conn):
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return
+        start = time.perf_counter()
+        try:
+            with conn:
+                conn.executemany(self.INSERT_SQL, rows)
+                self._update_rollups(conn, rows)
+                self._update_live_stats(conn, rows)
+            self.version += 1
+            if self.metrics is not None:
+                self.metrics.observe("database", time.perf_counter() - start)
+        except sqlite3.Error as e:
+            logging.error(f"Errore durante il salvataggio dei rilevamenti: {e}")
+            # Rimette in coda le righe per il prossimo tentativo senza crescere all'infinito
+            with self._lock:
+                if len(self._buffer) < self.batch_size * 10:
+                    self._buffer[:0] = rows
+
+    def _update_rollups(self, conn, rows):
+        """Aggiorna in modo incrementale le aggregazioni per minuto, ora e giorno"""
+        for table, size in ROLLUP_TABLES:
+            counts = {}
+            for row in rows:
+                if not counts_in_rollups(row[9]):
+                    continue
+                key = (rollup_bucket(row[0], size), row[1])
+                counts[key] = counts.get(key, 0) + 1
+            conn.executemany(self.ROLLUP_SQL.format(table=table),
+                             [(bucket, obj, count) for (bucket, obj), count in counts.items()])
+
+    def _update_live_stats(self, conn, rows):
+        """Totali, prima e ultima comparsa per oggetto, per ogni scrittore (anche --batch)"""
+        stats = {}
+        for row in rows:
+            total, first_seen, last_seen = stats.get(row[1], (0, None, row[0]))
+            if counts_in_rollups(row[9]):
+                total += 1
+                first_seen = row[0] if first_seen is None else min(first_seen, row[0])
+            stats[row[1]] = (total, first_seen, max(last_seen, row[0]))
+        conn.executemany(self.LIVE_STATS_SQL, [(obj,) + values for obj, values in stats.items()])
+
+class RateWindow:
+    """Conteggi degli ultimi span secondi in bucket circolari: O(1) per evento"""
+    def __init__(self, span, buckets=60):
+        self.width = span / buckets
+        self.counts = [0] * buckets
+        self.slots = [None] * buckets  # Intervallo a cui si riferisce ciascun bucket
+
+    def add(self, now, count=1):
+        slot = int(now // self.width)
+        index = slot % len(self.counts)
+        if self.slots[index] != slot:
+            # Bucket di un giro precedente: si riparte da zero
+            self.slots[index] = slot
+            self.counts[index] = 0
+        self.counts[index] += count
+
+    def total(self, now):
+        current = int(now // self.width)
+        return sum(count for count, slot in zip(self.counts, self.slots)
+                   if slot is not None and current - slot < len(self.counts))
+
+class ClassStats:
+    """Contatori di una classe di oggetti"""
+    __slots__ = ("total", "first_seen", "last_seen", "active", "peak", "minute", "hour")
+
+    def __init__(self, total=0, first_seen=None, last_seen=None, peak=0):
+        self.total = total
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.active = 0  # Tracce aperte in questo momento, su tutte le sorgenti
+        self.peak = peak
+        self.minute = RateWindow(60)
+        self.hour = RateWindow(3600)
+
+class LiveStats:
+    """Statistiche in memoria aggiornate dagli eventi delle tracce: interfaccia, voce e report senza query"""
+    # Totali e comparse li aggiorna DetectionWriter insieme alle righe: il checkpoint salva solo il picco
+    CHECKPOINT_SQL = ("INSERT INTO live_stats (object, total, peak_concurrent) VALUES (?, 0, ?) "
+                      "ON CONFLICT (object) DO UPDATE SET "
+                      "peak_concurrent = MAX(peak_concurrent, excluded.peak_concurrent)")
+
+    def __init__(self):
+        self.classes = {}
+        self.peak_total = 0  # Massimo di oggetti contemporanei di qualunque classe nella sessione
+        self._active_total = 0
+        self._dirty = set()  # Classi cambiate dall'ultimo checkpoint
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_db(cls, db_path):
+        """Riprende i contatori dal database, comprese le righe scritte da --batch"""
+        stats = cls()
+        conn = sqlite3.connect(db_path)
+        try:
+            for obj, total, first_seen, last_seen, peak in conn.execute(
+                    "SELECT object, total, first_seen, last_seen, peak_concurrent FROM live_stats"):
+                stats.classes[obj] = ClassStats(total, first_seen, last_seen, peak)
+        except sqlite3.Error as e:
+            logging.error(f"Errore nella lettura delle statistiche salvate: {e}")
+        finally:
+            conn.close()
+        return stats
+
+    def record(self, events, now=None):
+        """Aggiorna i contatori con gli eventi delle tracce (start, update, end)"""
+        now = now or time.time()
+        with self._lock:
+            for event in events:
+                label = event["label"]
+                stats = self.classes.get(label)
+                if stats is None:
+                    stats = self.classes[label] = ClassStats()
+                kind = event.get("event")
+                if kind is None or kind == "start":
+                    stats.total += 1
+                    stats.minute.add(now)
+                    stats.hour.add(now)
+                    if stats.first_seen is None:
+                        stats.first_seen = int(now)
+                if kind == "start":
+                    stats.active += 1
+                    self._active_total += 1
+                    stats.peak = max(stats.peak, stats.active)
+                    self.peak_total = max(self.peak_total, self._active_total)
+                elif kind == "end" and stats.active > 0:
+                    stats.active -= 1
+                    self._active_total -= 1
+                stats.last_seen = int(now)
+                self._dirty.add(label)
+
+    def totals(self):
+        """{oggetto: conteggio}, dal più frequente"""
+        with self._lock:
+            items = [(label, stats.total) for label, stats in self.classes.items()]
+        return dict(sorted(items, key=lambda item: item[1], reverse=True))
+
+    def snapshot(self, now=None):
+        """Una riga per classe con totale, frequenze recenti, prima e ultima comparsa e picco"""
+        now = now or time.time()
+        with self._lock:
+            rows = [{
+                "object": label,
+                "total": stats.total,
+                "last_minute": stats.minute.total(now),
+                "last_hour": stats.hour.total(now),
+                "first_seen": stats.first_seen,
+                "last_seen": stats.last_seen,
+                "active": stats.active,
+                "peak_concurrent": stats.peak
+            } for label, stats in self.classes.items()]
+        return sorted(rows, key=lambda row: row["total"], reverse=True)
+
+    def summary(self, limit=3):
+        """Frase breve per la chat e le risposte vocali"""
+        rows = self.snapshot()[:limit]
+        if not rows:
+            return "Non ho ancora rilevato nessun oggetto."
+        parts = [f"{row['object']} {row['total']} volte, {row['last_hour']} nell'ultima ora" for row in rows]
+        return "Ho visto " + "; ".join(parts) + "."
+
+    def checkpoint(self, conn):
+        """Salva il picco delle classi cambiate, chiamato dal thread di scrittura del database"""
+        with self._lock:
+            rows = [(label, self.classes[label].peak) for label in self._dirty]
+            self._dirty.clear()
+        if rows:
+            conn.executemany(self.CHECKPOINT_SQL, rows)
+
+class SharedFrameBuffer:
+    """Slot per frame preallocati in memoria condivisa, con un contatore di sequenza per il lettore"""
+    HEADER = 16  # Due int64: sequenza dell'ultimo frame scritto e slot che lo contiene
+
+    def __init__(self, shm, shape, slots):
+        self.shm = shm
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.header = np.ndarray((2,), dtype=np.int64, buffer=shm.buf)
+        self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=shm.buf, offset=self.HEADER)
+
+    @classmethod
+    def create(cls, shape, slots=3):
+        size = cls.HEADER + slots * int(np.prod(shape))
+        buffer = cls(shared_memory.SharedMemory(create=True, size=size), shape, slots)
+        buffer.header[:] = 0
+        return buffer
+
+    @classmethod
+    def attach(cls, name, shape, slots=3):
+        return cls(shared_memory.SharedMemory(name=name), shape, slots)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, frame):
+        seq = int(self.header[0]) + 1
+        slot = seq % self.slots
+        if frame.shape != self.shape:
+            frame = cv2.resize(frame, (self.shape[1], self.shape[0]))
+        np.copyto(self.frames[slot], frame)
+        # Lo slot viene pubblicato solo dopo essere stato scritto per intero
+        self.header[1] = slot
+        self.header[0] = seq
+
+    def read(self, last_seq, out=None):
+        """Copia l'ultimo frame (in out se dato) se più recente di last_seq; restituisce (frame o None, sequenza)"""
+        while True:
+            seq, slot = int(self.header[0]), int(self.header[1])
+            if seq == last_seq or seq == 0:
+                return None, last_seq
+            if out is not None and out.shape == self.shape:
+                frame = out
+                np.copyto(frame, self.frames[slot])
+            else:
+                frame = self.frames[slot].copy()
+            # Se nel frattempo lo scrittore può aver riscritto lo slot letto la copia è mista: si riprova
+            if int(self.header[0]) - seq < self.slots - 1:
+                return frame, seq
+
+    def close(self):
+        del self.header, self.frames
+        self.shm.close()
+
+    def disown(self):
+        """Toglie il segmento dal resource_tracker di questo processo: lo eliminerà chi lo ha agganciato"""
+        resource_tracker.unregister(self.shm._name, "shared_memory")
+
+    def unlink(self):
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass  # Già rimosso, per esempio da un processo di cattura terminato male
+
+def open_video_source(spec):
+    return cv2.VideoCapture(int(spec) if str(spec).isdigit() else spec)
+
+def capture_process(spec, info_queue, stop_event):
+    """Processo di cattura di una sorgente: decodifica fuori dal GIL del processo principale"""
+    cap = open_video_source(spec)
+    ok, frame = cap.read()
+    if not ok:
+        info_queue.put(None)
+        cap.release()
+        return
+    buffer = SharedFrameBuffer.create(frame.shape)
+    # Il segmento appartiene al processo principale: senza questo, alla fine del file il tracker
+    # del figlio lo eliminerebbe mentre il lettore lo sta ancora usando
+    buffer.disown()
+    info_queue.put((buffer.name, frame.shape))
+    # I file vengono letti al loro ritmo naturale, come una sorgente dal vivo
+    is_file = os.path.isfile(str(spec))
+    delay = 1.0 / (cap.get(cv2.CAP_PROP_FPS) or 25.0) if is_file else 0.0
+    try:
+        while not stop_event.is_set():
+            buffer.write(frame)
+            if delay:
+                time.sleep(delay)
+            ok, frame = cap.read()
+            if not ok:
+                if is_file:
+                    break
+                # Stream interrotto (RTSP, webcam scollegata): si riprova ad aprirlo
+                cap.release()
+                time.sleep(1.0)
+                cap = open_video_source(spec)
+                ok, frame = cap.read()
+                if not ok:
+                    continue
+    finally:
+        cap.release()
+        buffer.close()
+
+class CaptureWorker:
+    """Processo di cattura di una sorgente più il thread che ne consegna i frame alla pipeline"""
+    def __init__(self, name, spec, submit, capture, interval):
+        self.name = name
+        self.spec = spec
+        self.submit = submit
+        self.capture = capture  # capture(sorgente, read) -> FramePacket, vedi DetectionEngine._capture
+        self.interval = interval  # Secondi tra due frame consegnati, dal governor
+        self._stop = multiprocessing.Event()
+        self._info = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=capture_process, args=(spec, self._info, self._stop),
+                                               name=f"rico-cattura-{name}", daemon=True)
+        self.buffer = None
+        self.running = False
+        self._thread = None
+
+    def start(self):
+        self.running = True
+        self.process.start()
+        self._thread = threading.Thread(target=self._reader, name=f"rico-lettore-{self.name}", daemon=True)
+        self._thread.start()
+
+    def alive(self):
+        return self.running and self._thread is not None and self._thread.is_alive()
+
+    def _reader(self):
+        try:
+            info = self._info.get(timeout=30)
+        except queue.Empty:
+            info = None
+        if info is None:
+            logging.error(f"Impossibile aprire la sorgente {self.spec}")
+            self.running = False
+            return
+        self.buffer = SharedFrameBuffer.attach(*info)
+        last_seq = 0
+
+        def read(out):
+            nonlocal last_seq
+            frame, last_seq = self.buffer.read(last_seq, out)
+            return frame
+
+        next_due = 0.0
+        while self.running:
+            now = time.monotonic()
+            if now < next_due:
+                # Il processo continua a decodificare, qui si copia solo il frame che serve
+                time.sleep(min(next_due - now, 0.05))
+                continue
+            packet = self.capture(self.name, read)
+            if packet is not None:
+                self.submit(packet)
+                next_due = now + self.interval()
+            elif not self.process.is_alive():
+                break  # Fine del file o processo terminato
+            else:
+                time.sleep(0.002)
+        self.running = False
+
+    def stop(self):
+        self.running = False
+        self._stop.set()
+        self.process.join(timeout=2.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        if self._thread:
+            self._thread.join(timeout=1.0)
+        if self.buffer:
+            self.buffer.close()
+            self.buffer.unlink()
+            self.buffer = None
+
+def unique_source_name(base, taken):
+    """base se libero, altrimenti base#2, base#3, ...: file omonimi in cartelle diverse restano distinti"""
+    name, index = base, 1
+    while name in taken:
+        index += 1
+        name = f"{base}#{index}"
+    return name
+
+class SourceRegistry:
+    """Sorgenti video (webcam, RTSP, file) catturate ciascuna nel proprio processo"""
+    def __init__(self, submit, capture, interval):
+        self.submit = submit
+        self.capture = capture
+        self.interval = interval
+        self.workers = {}
+        self._claimed = {}  # nome -> sorgente letta fuori dal registro (start_file)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def source_name(spec):
+        spec = str(spec)
+        if spec.isdigit():
+            return f"cam{spec}"
+        if "://" in spec:
+            return spec.split("://", 1)[0] + ":" + spec.split("://", 1)[1].split("/", 1)[0].split("@")[-1]
+        return f"file:{os.path.basename(spec)}"
+
+    def claim(self, spec):
+        """Riserva un nome libero per una sorgente letta altrove, da restituire con release"""
+        with self._lock:
+            name = unique_source_name(self.source_name(spec), self._taken())
+            self._claimed[name] = spec
+        return name
+
+    def release(self, name):
+        with self._lock:
+            self._claimed.pop(name, None)
+
+    def _taken(self):
+        return set(self._claimed) | {name for name, worker in self.workers.items() if worker.alive()}
+
+    def open(self, spec, name=None):
+        name = name or self.source_name(spec)
+        with self._lock:
+            worker = self.workers.get(name)
+            if worker is not None and worker.alive() and worker.spec == spec:
+                return name
+            # Lo stesso nome breve per un'altra sorgente (file omonimi, stesso host RTSP) riceve un indice
+            name = unique_source_name(name, self._taken())
+            worker = CaptureWorker(name, spec, self.submit, self.capture, self.interval)
+            self.workers[name] = worker
+        worker.start()
+        return name
+
+    def close(self, name):
+        with self._lock:
+            worker = self.workers.pop(name, None)
+        if worker:
+            worker.stop()
+
+    def close_all(self):
+        for name in list(self.workers):
+            self.close(name)
+
+    def active(self):
+        return [name for name, worker in self.workers.items() if worker.alive()]
+
+class DetectionEngine:
+    """Cattura, inferenza, tracciamento, allerte e database, senza alcuna dipendenza dall'interfaccia"""
+    def __init__(self, config=None, model=None, cap=None, db_path=DB_PATH):
+        self.config = config or load_config()
+        self.model = model
+        self._model_lock = threading.Lock()
+        self.cap = cap
+
+        self.running = False
+        self.screen_running = False
+        self.file_running = False
+        self.detected_objects = []
+
+        self.recording = False
+        self.video_recorder = VideoRecorder.from_config(self.config["recording"])
+        self.alert_system = None
+
+        # Ascoltatori facoltativi, chiamati dai thread della pipeline
+        self.frame_listeners = []  # (packet) a fine pipeline
+        self.event_listeners = []  # (eventi delle tracce, sorgente)
+        self.alert_listeners = []  # (allerta)
+
+        # Dimensione dell'immagine da mostrare; None = nessuna visualizzazione (modalità headless)
+        self.display_size = None
+
+        # Letterbox e risoluzione di inferenza adattiva
+        self.preprocessor = Preprocessor.from_config(self.config["preprocess"])
+
+        # Filtro di movimento: i frame statici riusano gli ultimi rilevamenti della sorgente
+        self.motion_gate = MotionGate.from_config(self.config["motion"])
+        self._last_detections = {}
+
+        # Un tracker per sorgente: id persistenti e righe nel database solo sugli eventi delle tracce
+        self.trackers = {}
+
+        # Ritmo delle catture al posto delle pause fisse: segue il modello, il budget e lo stato dell'app
+        self.governor = FrameRateGovernor.from_config(self.config["governor"])
+
+        # Tempi per stadio, frame scartati e code, per l'overlay e l'endpoint /metrics
+        self.metrics = PipelineMetrics()
+
+        # Pipeline a stadi: cattura, inferenza, annotazione e visualizzazione in parallelo
+        self.pipeline = FramePipeline(self._infer_batch, self._annotate_frame, self._output_frame,
+                                      metrics=self.metrics)
+
+        # Sorgenti aggiuntive, ciascuna catturata nel proprio processo
+        self.registry = SourceRegistry(self._submit, self._capture, self.governor.capture_interval)
+
+        # Zone d'interesse: il modello vede solo i loro ritagli, a risoluzione piena
+        self.roi = RegionsOfInterest.from_config(self.config["roi"])
+
+        # Un ring di slot preallocati per sorgente: la cattura scrive lì invece di allocare un frame nuovo
+        self.frame_rings = {}
+        self._display_buffers = {}  # sorgente -> (ridotto, RGB) riusati dallo stadio di annotazione
+
+        # Le scritture passano dal thread dedicato con la sua connessione.
+        # Lo schema va preparato prima con prepare_database (splash, headless, batch, bench)
+        self.db_writer = DetectionWriter(db_path, metrics=self.metrics)
+
+        # Contatori in memoria aggiornati a ogni evento, salvati periodicamente dal writer
+        self.live_stats = LiveStats.from_db(db_path)
+        self.db_writer.add_checkpoint(self.live_stats.checkpoint, 60.0)
+        self.db_writer.start()
+        self._register_metrics()
+        if model is not None:
+            # Modello già caricato dietro lo splash screen: load_model non lo ricarica e non congelerebbe nulla
+            self._freeze_heap()
+
+    def _register_metrics(self):
+        metrics = self.metrics
+        dropped = ("rico_frames_dropped_total", "Frame scartati perché lo stadio successivo era occupato")
+        depth = ("rico_queue_depth", "Elementi in attesa nelle code della pipeline")
+        metrics.register("counter", *dropped, {"where": "inferenza"}, lambda: self.pipeline.scheduler.dropped)
+        metrics.register("gauge", *depth, {"queue": "inferenza"}, self.pipeline.scheduler.depth)
+        for name, _, stage_queue in self.pipeline.stages:
+            metrics.register("counter", *dropped, {"where": name}, lambda q=stage_queue: q.dropped)
+            metrics.register("gauge", *depth, {"queue": name}, stage_queue.qsize)
+        metrics.register("counter", *dropped, {"where": "registrazione"}, lambda: self.video_recorder.dropped)
+        metrics.register("gauge", *depth, {"queue": "registrazione"}, self.video_recorder.queued)
+        metrics.register("gauge", *depth, {"queue": "database"}, self.db_writer.pending)
+        metrics.register("counter", "rico_frames_unchanged_total", "Frame non analizzati perché la scena era ferma",
+                         {}, lambda: self.motion_gate.skipped)
+        metrics.register("counter", "rico_ring_exhausted_total", "Frame allocati a parte con il ring pieno", {},
+                         lambda: sum(ring.exhausted for ring in list(self.frame_rings.values())))
+        metrics.register("gauge", "rico_capture_interval_seconds", "Intervallo tra due catture scelto dal governor",
+                         {}, self.governor.capture_interval)
+        metrics.register("gauge", "rico_inference_interval_seconds",
+                         "Intervallo tra due frame inviati al modello scelto dal governor", {}, self.governor.interval)
+        metrics.register("gauge", "rico_inference_size", "Lato del letterbox usato dal modello", {},
+                         lambda: self.preprocessor.size)
+
+    def load_model(self):
+        with self._model_lock:
+            if self.model is None:
+                self.model = load_inference_backend(self.config["inference"])
+                self._freeze_heap()
+
+    @staticmethod
+    def _freeze_heap():
+        # Modello e moduli restano vivi per tutta la sessione: il GC non deve riesaminarli
+        gc.collect()
+        gc.freeze()
+
+    def start_camera(self, index=0):
+        self.load_model()
+        if self.cap is None or not self.cap.isOpened():
+            self.cap = open_camera(index)
+        self.pipeline.start()
+        self.running = True
+        threading.Thread(target=self.detect_objects, daemon=True).start()
+
+    def start_screen(self):
+        self.load_model()
+        self.pipeline.start()
+        self.screen_running = True
+        threading.Thread(target=self.detect_screen_objects, daemon=True).start()
+
+    def start_file(self, file_path, realtime=True):
+        """Avvia il riconoscimento su un file video o uno stream, in parallelo alle altre sorgenti"""
+        self.load_model()
+        self.pipeline.start()
+        self.file_running = True
+        thread = threading.Thread(target=self.detect_file_objects, args=(file_path, realtime), daemon=True)
+        thread.start()
+        return thread
+
+    def enable_alerts(self, sound=True):
+        """Attiva le regole d'allerta; il registratore tiene il pre-roll solo dove una regola registra"""
+        self.alert_system = AlertSystem.from_config(self.config["alerts"], sound=sound)
+        self.video_recorder.preroll_sources = self.alert_system.recording_sources()
+
+    def add_source(self, spec, name=None):
+        """Aggiunge una webcam (indice), uno stream RTSP/HTTP o un file catturato in un processo dedicato"""
+        self.load_model()
+        self.pipeline.start()
+        return self.registry.open(spec, name)
+
+    def stop(self):
+        self.running = False
+        self.screen_running = False
+        self.file_running = False
+        self.registry.close_all()
+        self.pipeline.stop()
+        # Le tracce ancora aperte vengono chiuse, così ogni oggetto ha il suo evento di fine
+        for source, tracker in self.trackers.items():
+            self.save_to_db(tracker.close(), source)
+        if self.cap is not None and self.cap.isOpened():
+            self.cap.release()
+        if self.recording:
+            self.video_recorder.stop_recording()
+            self.recording = False
+
+    def close(self):
+        """Ferma tutto e svuota su disco i rilevamenti ancora in memoria"""
+        try:
+            self.stop()
+        finally:
+            # Anche se la chiusura di una sorgente fallisce i rilevamenti in coda vanno salvati
+            self.video_recorder.close()
+            self.db_writer.close()
+        for ring in self.frame_rings.values():
+            ring.close()
+        self.frame_rings.clear()
+
+    def _capture(self, source, read):
+        """Legge un frame direttamente in uno slot libero del ring della sorgente
+
+        read(out) restituisce il frame (scritto in out se possibile) oppure None.
+        """
+        ring = self.frame_rings.get(source)
+        slot = ring.acquire() if ring is not None else None
+        out = ring.view(slot) if slot is not None else None
+        start = time.perf_counter()
+        frame = read(out)
+        if frame is not None:
+            self.metrics.observe("cattura", time.perf_counter() - start)
+        if slot is not None:
+            if frame is not None and frame.ctypes.data == out.ctypes.data:
+                return FramePacket(frame, source, ring, slot)
+            ring.release(slot)
+        if frame is None:
+            return None
+        if ring is None or ring.shape != frame.shape:
+            # Primo frame o risoluzione cambiata: dal prossimo si usa un ring della dimensione giusta
+            if ring is not None:
+                ring.close()
+            self.frame_rings[source] = FrameRing(frame.shape, self.pipeline.frames_in_flight())
+        return FramePacket(frame, source)
+
+    @staticmethod
+    def _video_reader(cap):
+        def read(out):
+            ret, frame = cap.read(out)
+            return frame if ret else None
+        return read
+
+    def detect_objects(self):
+        # Stadio di cattura: non attende mai il modello, consegna il frame alla pipeline
+        read = self._video_reader(self.cap)
+        next_due = 0.0
+        while self.running:
+            now = time.monotonic()
+            if now < next_due:
+                # grab() scarta senza decodificare: il buffer della webcam resta fresco e il ritmo lo dà la camera
+                if not self.cap.grab():
+                    time.sleep(0.01)
+                continue
+            next_due = now + self.governor.capture_interval()
+            packet = self._capture("webcam", read)
+            if packet is not None:
+                self._submit(packet)
+            else:
+                time.sleep(0.01)
+    
+    def detect_screen_objects(self):
+        capture = None
+        next_due = 0.0
+        while self.screen_running:
+            try:
+                # Lo schermo non ha un ritmo proprio: si attende la prossima cattura prevista
+                delay = next_due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_due = time.monotonic() + self.governor.capture_interval()
+                # Sessione di cattura persistente, creata nel thread che la usa
+                if capture is None:
+                    capture = ScreenCapture.from_config(self.config["screen"])
+                    grabbed = {}
+
+                    def read(out):
+                        frame, grabbed["regions"] = capture.grab(out)
+                        return frame
+                packet = self._capture("screen", read)
+                regions = grabbed["regions"]
+                if regions == []:
+                    packet.release()
+                else:
+                    # Solo le zone modificate vanno al modello, il resto riusa i rilevamenti precedenti
+                    if regions is not None:
+                        packet.regions = regions
+                        packet.partial = True
+                    if self._submit(packet):
+                        capture.commit()
+
+            except Exception as e:
+                logging.error(f"Errore durante la cattura dello schermo: {e}")
+                if capture is not None:
+                    capture.close()
+                    capture = None
+                time.sleep(1)  # Pausa più lunga in caso di errore
+        if capture is not None:
+            capture.close()
+    
+    def detect_file_objects(self, file_path, realtime=True):
+        cap = cv2.VideoCapture(file_path)
+        # Rispetta la velocità del video così da condividere il batch con le sorgenti live
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+        source = self.registry.claim(file_path)
+        read = self._video_reader(cap)
+        next_due = 0.0
+        try:
+            while self.file_running:
+                now = time.monotonic()
+                if realtime and now < next_due:
+                    # Frame saltato senza decodifica, il video avanza comunque alla sua velocità
+                    if not cap.grab():
+                        break
+                    time.sleep(1.0 / fps)
+                    continue
+                next_due = now + self.governor.capture_interval()
+                packet = self._capture(source, read)
+                if packet is None:
+                    break
+                self._submit(packet)
+                if realtime:
+                    time.sleep(1.0 / fps)
+        finally:
+            cap.release()
+            self.registry.release(source)
+
+    def _submit(self, packet):
+        """Manda il frame al modello (True) se il governor lo prevede, altrimenti lo mostra interpolato (False)"""
+        # I frame parziali non si saltano: le loro zone non verrebbero più riesaminate
+        if packet.partial or self.governor.should_infer(packet.source, time.monotonic()):
+            self.pipeline.submit(packet)
+            return True
+        # Il modello non gira, il tracker interpola la posizione degli oggetti
+        packet.detections = self._tracker(packet.source).predict(time.time())
+        self.pipeline.bypass(packet)
+        return False
+
+    def process_frame(self, frame):
+        """Elabora un frame in modo sincrono attraversando tutti gli stadi della pipeline"""
+        packet = FramePacket(frame)
+        try:
+            if self._infer_frame(packet) is None:
+                return
+            self._annotate_frame(packet)
+            self._output_frame(packet)
+        except Exception as e:
+            logging.error(f"Errore durante l'elaborazione del frame: {e}")
+
+    def _infer_frame(self, packet):
+        """Stadio di inferenza per un singolo frame"""
+        results = self._infer_batch([packet])
+        return results[0] if results else None
+
+    def _infer_batch(self, packets):
+        """Esegue YOLO su un micro-batch di frame provenienti da sorgenti diverse"""
+        now = time.time()
+        batch = []
+        reused = []
+        for packet in packets:
+            # Le catture con zone hanno già superato il proprio controllo dei cambiamenti
+            if packet.regions is None and not self.motion_gate.should_infer(packet.source, packet.frame, now):
+                # Scena invariata: nessuna chiamata al modello
+                packet.detections = list(self._last_detections.get(packet.source, []))
+                reused.append(packet)
+                continue
+            h, w = packet.frame.shape[:2]
+            crops = self.roi.crops(packet.source, (w, h))
+            if crops is not None:
+                # Solo i ritagli delle zone vanno al modello e fuori dalle zone non resta nulla
+                packet.regions = crops
+                packet.partial = False
+            batch.append(packet)
+        if not batch:
+            self._store_detections(reused, now)
+            return reused
+
+        # Tutto il batch usa la stessa risoluzione, letterbox senza deformare le proporzioni
+        size = self.preprocessor.size
+        inputs, owners = [], []
+        preprocess_start = time.perf_counter()
+        for packet in batch:
+            for region in packet.regions or [None]:
+                if region is None:
+                    crop, offset = packet.frame, (0, 0)
+                else:
+                    x1, y1, x2, y2 = region
+                    crop, offset = packet.frame[y1:y2, x1:x2], (x1, y1)
+                image, transform = self.preprocessor.letterbox(crop, size, index=len(inputs))
+                inputs.append(image)
+                owners.append((packet, transform, offset, crop.shape))
+
+        self.metrics.observe("preprocess", time.perf_counter() - preprocess_start)
+
+        # Una sola chiamata al modello per tutto il batch
+        start = time.perf_counter()
+        all_results = self.model.predict(inputs, size)
+        latency = time.perf_counter() - start
+        self.preprocessor.record_latency(latency)
+        self.governor.record_inference(latency)
+        self.metrics.observe("modello", latency)
+
+        for results, (packet, transform, offset, shape) in zip(all_results, owners):
+            for det in results:
+                # Coordinate riportate sul frame a piena risoluzione
+                x1, y1, x2, y2 = Preprocessor.map_box(det["box"], transform, shape)
+                det["box"] = (x1 + offset[0], y1 + offset[1], x2 + offset[0], y2 + offset[1])
+                packet.detections.append(det)
+        for packet in batch:
+            if packet.source in self.roi.zones:
+                h, w = packet.frame.shape[:2]
+                packet.detections = [det for det in packet.detections
+                                     if self.roi.contains(packet.source, det["box"], (w, h))]
+            if packet.partial:
+                packet.detections += [
+                    det for det in self._last_detections.get(packet.source, [])
+                    if not any(box_center_in(det["box"], region) for region in packet.regions)
+                ]
+            self._last_detections[packet.source] = packet.detections
+
+        self._store_detections(reused + batch, now)
+        return reused + batch
+
+    def _tracker(self, source):
+        tracker = self.trackers.get(source)
+        if tracker is None:
+            # Lo chiedono sia la cattura sia l'inferenza: setdefault evita due tracker per la stessa sorgente
+            tracker = self.trackers.setdefault(source, ObjectTracker.from_config(self.config["tracking"]))
+        return tracker
+
+    def _store_detections(self, packets, now):
+        for packet in packets:
+            packet.detections, events = self._tracker(packet.source).update(packet.detections, now)
+            self.detected_objects = [det["label"] for det in packet.detections]
+            # Salva qui, prima della visualizzazione, così nessuna sorgente perde i propri eventi
+            self.save_to_db(events, packet.source)
+            if events:
+                self._handle_events(events, packet.source)
+            if self.alert_system:
+                self._evaluate_rules(packet, now)
+
+    def _handle_events(self, events, source):
+        for listener in self.event_listeners:
+            listener(events, source)
+
+    def _evaluate_rules(self, packet, now):
+        """Regole d'allerta sui rilevamenti tracciati: allerte e clip registrate attorno agli eventi"""
+        h, w = packet.frame.shape[:2]
+        alerts, record, clip = self.alert_system.evaluate(packet.source, packet.detections, (w, h), now)
+        if alerts or record:
+            # Qualcosa sta succedendo: le catture accelerano finché dura
+            self.governor.alert()
+        if record:
+            # Ogni frame che soddisfa la regola sposta in avanti la fine della clip
+            self.video_recorder.trigger(packet.source, clip)
+        for alert in alerts:
+            alert["source"] = packet.source
+            for listener in self.alert_listeners:
+                listener(alert)
+
+    def _annotate_frame(self, packet):
+        """Stadio di annotazione: disegna le etichette sul frame originale e prepara l'immagine da mostrare"""
+        frame = packet.frame
+        # Testo proporzionato alla risoluzione del frame
+        font_scale = max(0.5, frame.shape[1] / 1280.0 * 0.6)
+        thickness = max(1, int(round(font_scale * 3)))
+        for det in packet.detections:
+            x1, y1, x2, y2 = det["box"]
+            
+            # Disegna una sfera bianca dietro il testo
+            font = cv2.FONT_HERSHEY_SIMPLEX
+            text = f"{det['label']} {det['confidence']:.2f}"
+            text_size = cv2.getTextSize(text, font, font_scale, thickness)[0]
+            text_x, text_y = x1, max(y1 - 10, text_size[1])
+            radius = max(text_size) // 2 + 5
+            cv2.circle(frame, (text_x + text_size[0] // 2, text_y - text_size[1] // 2), radius, (255, 255, 255), -1)
+            cv2.putText(frame, text, (text_x, text_y), font, font_scale, (0, 0, 0), thickness)
+
+        # Senza interfaccia non serve preparare l'immagine da mostrare
+        if self.display_size is None:
+            return packet
+
+        # Ridimensiona solo la copia da mostrare, il frame resta a piena risoluzione per la registrazione
+        h, w = frame.shape[:2]
+        display_w, display_h = self.display_size
+        scale = min(display_w / w, display_h / h, 1.0)
+        # Conversioni in buffer riusati per sorgente: PIL copia comunque i pixel in fromarray
+        resized, rgb = self._display_buffers.get(packet.source, (None, None))
+        display = frame
+        if scale < 1.0:
+            display = resized = cv2.resize(frame, (max(1, int(w * scale)), max(1, int(h * scale))),
+                                           dst=resized, interpolation=cv2.INTER_AREA)
+        rgb = cv2.cvtColor(display, cv2.COLOR_BGR2RGB, dst=rgb)
+        self._display_buffers[packet.source] = (resized, rgb)
+        packet.image = Image.fromarray(rgb)
+        return packet
+
+    def _output_frame(self, packet):
+        """Ultimo stadio: registra il frame e lo consegna a chi lo mostra (interfaccia, server, ...)"""
+        # Dalla cattura alla consegna: la latenza vista da chi guarda
+        self.metrics.observe("latenza_totale", time.time() - packet.timestamp)
+        # Il registratore copia il frame solo se registra o tiene un pre-roll, la codifica è sul suo thread
+        self.video_recorder.record_frame(packet.frame, packet.source, packet.timestamp)
+        for listener in self.frame_listeners:
+            listener(packet)
+        return packet
+
+    def save_to_db(self, detections, source="webcam"):
+        if not detections:
+            return
+            
+        # Accoda al writer in background, il thread di rilevamento non attende il disco
+        now = time.time()
+        self.db_writer.add(detection_rows(detections, source, now))
+        self.live_stats.record(detections, now)
+
 class ObjectDetectionApp:
-    def __init__(self, root, lang="it"):
+    def __init__(self, root, lang="it", profile_startup=False, model=None, cap=None, config=None):
         self.root = root
         self.lang = lang
+        self.profile_startup = profile_startup
+        self.config = config or load_config()
         self.minimized = False
         self.root.title("Progetto Negrisolo R.I.C.O")
         
@@ -175,31 +2317,56 @@ class ObjectDetectionApp:
         }
 
         # Inizializza l'interfaccia
-        self.setup_title_bar()
-        self.setup_menu()
-        self.setup_frames()
-        self.setup_buttons()
-        self.setup_chat()
+        with startup_profile.measure("interfaccia"):
+            self.setup_title_bar()
+            self.setup_menu()
+            self.setup_frames()
+            self.setup_buttons()
+            self.setup_chat()
 
-        self.night_mode = False  # Aggiungi attributo per la modalità notte
+        # Unico punto di accesso ai widget per i thread di lavoro
+        self.ui = UIDispatcher(self.root, self._render_packet)
+        self.ui.start()
+
+        self.night_mode = False  # Aggiungi attributo per la modalità notte
 
-        self.cap = cv2.VideoCapture(0)
-        self.running = False
-        self.screen_running = False
-        self.detected_objects = []
-        self.model = None  # Defer model loading
         self.history = []  # Storico degli oggetti rilevati
 
         self.minimized = False  # Aggiungi questa variabile
 
-        self.recording = False
-        self.video_recorder = VideoRecorder()
+        # Lo schema lo ha già preparato lo StartupLoader, qui si apre solo la connessione
+        with startup_profile.measure("connessione database"):
+            self.init_db()
 
-        # Inizializza il database
-        self.init_db()
+        # Motore di rilevamento condiviso con la modalità headless.
+        # Modello e webcam possono arrivare già pronti dallo StartupLoader
+        self.engine = DetectionEngine(self.config, model=model,
+                                      cap=cap if cap is not None else open_camera())
+        # Statistiche dalle aggregazioni, con la cache invalidata da ogni scrittura del motore
+        self.stats = AdvancedStats(self.conn, data_version=lambda: self.engine.db_writer.version)
+        self.engine.display_size = (960, 540)  # Aggiornata dagli eventi <Configure> del label video
+        self.engine.frame_listeners.append(self.ui.post_frame)
+        self.ui.metrics = self.engine.metrics
+        self.engine.metrics.register("counter", "rico_frames_dropped_total",
+                                     "Frame scartati perché lo stadio successivo era occupato",
+                                     {"where": "interfaccia"}, lambda: self.ui.merged)
+        self._show_metrics = False
+        self._metrics_lines = ([], 0.0)  # Righe dell'overlay e istante in cui sono state calcolate
+        self._source_frames = {}  # Ultimo frame mostrato per ogni sorgente, per la griglia
+        self._display_layout = {}  # sorgente -> (x, y, larghezza, altezza) nell'immagine mostrata
+        self._display_image_size = (0, 0)
+        self._zone_edit = None  # Durante il disegno: {"source": ..., "points": [...]}
+        self.engine.alert_listeners.append(lambda alert: self.update_chat(alert["message"]))
+
+        # API locale facoltativa per dashboard esterne
+        self.server = None
+        if self.config["server"]["enabled"]:
+            self.server = DetectionServer(self.engine, **self.config["server"])
+            self.server.start()
 
         # Carica le immagini per il pulsante modalità notte
-        self.load_night_mode_images()
+        with startup_profile.measure("icone"):
+            self.load_night_mode_images()
 
         # Crea il file di segnalazione per indicare che l'app è completamente caricata
         with open("app_loaded.signal", "w") as f:
@@ -212,8 +2379,6 @@ class ObjectDetectionApp:
 
         self._setup_resource_management()
         self._cache = {}  # Cache per i risultati
-        self._last_detection_time = 0
-        self._detection_interval = 0.1  # Intervallo minimo tra rilevamenti (secondi)
 
         # Aggiungi questo dopo aver impostato overrideredirect
         self.root.bind('<Map>', self._on_deiconify)
@@ -222,18 +2387,35 @@ class ObjectDetectionApp:
     def _setup_resource_management(self):
         # Pulisci le risorse quando l'app viene chiusa
         self.root.protocol("WM_DELETE_WINDOW", self._cleanup)
-        
-        # Limita l'uso della CPU
-        self._max_fps = 30
-        self._frame_time = 1.0 / self._max_fps
+        # L'uso della CPU lo regola il governor del motore (sezione "governor" della configurazione)
+
+    @property
+    def minimized(self):
+        return self._minimized
+
+    @minimized.setter
+    def minimized(self, value):
+        self._minimized = value
+        # Con la finestra ridotta a icona il motore cattura più di rado
+        engine = getattr(self, "engine", None)
+        if engine is not None:
+            engine.governor.background = value
 
     def _cleanup(self):
         self.stop_detection()
+        if self.server:
+            self.server.stop()
+        self.ui.stop()
+        self.engine.close()
         self.conn.close()
         cv2.destroyAllWindows()
         self.root.quit()
 
     def _init_delayed(self):
+        if self.engine.model is not None:
+            if self.profile_startup:
+                self._finish_startup_profile()
+            return
         # Carica il modello in background
         threading.Thread(target=self.load_model, daemon=True).start()
 
@@ -263,8 +2445,9 @@ class ObjectDetectionApp:
         self.menubar.add_cascade(label="File", menu=self.file_menu)
         self.file_menu.add_command(label="Salva Immagine", command=self.save_image)
         self.file_menu.add_command(label="Esporta Statistiche", command=self.export_statistics)
+        self.file_menu.add_command(label="Apri Video...", command=self.start_file_detection)
         self.file_menu.add_separator()
-        self.file_menu.add_command(label="Esci", command=self.root.quit)
+        self.file_menu.add_command(label="Esci", command=self._cleanup)
 
         # Menu Strumenti
         self.tools_menu = Menu(self.menubar, tearoff=0)
@@ -282,6 +2465,13 @@ class ObjectDetectionApp:
         self.video_menu = Menu(self.menubar, tearoff=0)
         self.menubar.add_cascade(label="Video", menu=self.video_menu)
         self.video_menu.add_command(label="Schermo Intero", command=self.toggle_fullscreen)
+        self.video_menu.add_separator()
+        self.video_menu.add_command(label="Aggiungi Sorgente...", command=self.add_video_source)
+        self.video_menu.add_command(label="Chiudi Sorgenti Aggiuntive", command=self.close_video_sources)
+        self.video_menu.add_separator()
+        self.video_menu.add_command(label="Mostra/Nascondi Metriche", command=self.toggle_metrics_overlay)
+        self.video_menu.add_command(label="Disegna Zona", command=self.start_zone_edit)
+        self.video_menu.add_command(label="Cancella Zone", command=self.clear_zones)
 
     def toggle_fullscreen(self):
         self.fullscreen = not getattr(self, 'fullscreen', False)
@@ -329,6 +2519,11 @@ class ObjectDetectionApp:
         # Area dedicata al video (più grande)
         self.label = Label(self.video_frame, bg=self.colors['secondary'])
         self.label.pack(fill=tk.BOTH, expand=True)
+        self.label.bind('<Configure>', self._on_video_resize)
+        self.label.bind('<Button-1>', self._on_zone_click)
+        self.label.bind('<Button-3>', self._finish_zone)
+        self.root.bind('<Return>', self._finish_zone)
+        self.root.bind('<Escape>', self._cancel_zone_edit)
 
         # Label per oggetti rilevati sotto il video
         self.detected_label = Label(
@@ -373,6 +2568,10 @@ class ObjectDetectionApp:
         self.chat_text.configure(yscrollcommand=self.scrollbar.set)
         self.scrollbar.configure(command=self.chat_text.yview)
 
+    def _on_video_resize(self, event):
+        if event.width > 1 and event.height > 1 and hasattr(self, 'engine'):
+            self.engine.display_size = (event.width, event.height)
+
     def setup_buttons(self):
         # Container per i pulsanti con spaziatura uniforme
         self.button_container = Frame(self.sidebar, bg=self.colors['secondary'])
@@ -422,7 +2621,7 @@ class ObjectDetectionApp:
         self.close_button = RoundedButton(
             self.button_container,
             text=languages[self.lang]["close_app"],
-            command=self.root.quit,
+            command=self._cleanup,
             width=button_width,  # Larghezza aumentata
             height=40,          # Altezza aumentata
             corner_radius=10,
@@ -562,123 +2761,190 @@ class ObjectDetectionApp:
         self.minimized = False
 
     def init_db(self):
-        self.conn = sqlite3.connect('object_detection.db')
+        # Connessione del thread Tk, usata solo per le letture delle statistiche
+        self.conn = sqlite3.connect(DB_PATH)
         self.cursor = self.conn.cursor()
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS detections
-                               (timestamp TEXT, object TEXT)''')
-        self.conn.commit()
 
     def load_model(self):
-        if self.model is None:
-            from ultralytics import YOLO
-            self.model = YOLO("yolov8n.pt")
+        self.engine.load_model()
+        if self.profile_startup:
+            self.ui.call(self._finish_startup_profile)
+
+    def _finish_startup_profile(self):
+        """Stampa il profilo di avvio e chiude l'applicazione (--profile-startup)"""
+        report = startup_profile.report()
+        print(report)
+        logging.info(report)
+        self._cleanup()
 
     def start_detection(self):
-        self.load_model()
-        self.running = True
-        threading.Thread(target=self.detect_objects, daemon=True).start()
+        self.engine.start_camera()
     
     def toggle_screen_detection(self):
-        self.load_model()
-        self.screen_running = not self.screen_running
-        if self.screen_running:
-            threading.Thread(target=self.detect_screen_objects, daemon=True).start()
+        if self.engine.screen_running:
+            self.engine.screen_running = False
+        else:
+            self.engine.start_screen()
     
+    def start_file_detection(self):
+        """Avvia il riconoscimento su un file video, in parallelo alle altre sorgenti"""
+        file_path = filedialog.askopenfilename(
+            filetypes=[("Video", "*.mp4 *.avi *.mkv *.mov"), ("All files", "*.*")]
+        )
+        if not file_path:
+            return
+        self.engine.start_file(file_path)
+        self.update_chat(f"Riconoscimento avviato su {os.path.basename(file_path)}")
+
     def stop_detection(self):
-        self.running = False
-        self.screen_running = False
-        if self.cap.isOpened():
-            self.cap.release()
+        self.engine.stop()
         cv2.destroyAllWindows()
-    
-    def detect_objects(self):
-        while self.running:
-            ret, frame = self.cap.read()
-            if ret:
-                self.process_frame(frame)
-            time.sleep(0.01)
-    
-    def detect_screen_objects(self):
-        while self.screen_running:
-            try:
-                # Usa mss invece di pyautogui per screenshot più veloci
-                with mss.mss() as sct:
-                    screenshot = sct.grab(sct.monitors[0])
-                    frame = np.array(screenshot)
-                    frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
-                    self.process_frame(frame)
-                    
-                # Rilascia la memoria
-                del frame
-                gc.collect()
-                
-                time.sleep(0.1)  # Aumenta l'intervallo tra gli screenshot
-                
-            except Exception as e:
-                logging.error(f"Errore durante la cattura dello schermo: {e}")
-                time.sleep(1)  # Pausa più lunga in caso di errore
-    
+
     def process_frame(self, frame):
-        current_time = time.time()
-        if current_time - self._last_detection_time < self._detection_interval:
+        """Elabora un frame in modo sincrono attraversando tutti gli stadi della pipeline"""
+        self.engine.process_frame(frame)
+
+    @property
+    def detected_objects(self):
+        return self.engine.detected_objects
+
+    @property
+    def recording(self):
+        return self.engine.recording
+
+    def _compose_grid(self, packets):
+        """Affianca l'ultimo frame di ogni sorgente in una griglia grande quanto il label video"""
+        width, height = self.engine.display_size
+        cols = math.ceil(math.sqrt(len(packets)))
+        rows = math.ceil(len(packets) / cols)
+        cell_w, cell_h = width // cols, height // rows
+        grid = Image.new("RGB", (cell_w * cols, cell_h * rows), self.colors['secondary'])
+        draw = ImageDraw.Draw(grid)
+        for index, (source, packet) in enumerate(packets):
+            tile = packet.image.copy()
+            tile.thumbnail((cell_w, cell_h))
+            x, y = (index % cols) * cell_w, (index // cols) * cell_h
+            tile_x, tile_y = x + (cell_w - tile.width) // 2, y + (cell_h - tile.height) // 2
+            grid.paste(tile, (tile_x, tile_y))
+            self._display_layout[source] = (tile_x, tile_y, tile.width, tile.height)
+            draw.text((x + 8, y + 8), source, fill="#ffffff")
+        return grid
+
+    def _draw_zones(self, image):
+        """Disegna le zone d'interesse e quella in corso di disegno sopra i frame mostrati"""
+        draw = ImageDraw.Draw(image)
+        for source, (x, y, w, h) in self._display_layout.items():
+            polygons = list(self.engine.roi.zones.get(source, []))
+            for polygon in polygons:
+                draw.polygon([(x + px * w, y + py * h) for px, py in polygon], outline="#00ff00")
+            if self._zone_edit and self._zone_edit["source"] == source:
+                points = [(x + px * w, y + py * h) for px, py in self._zone_edit["points"]]
+                if len(points) > 1:
+                    draw.line(points, fill="#ffcc00", width=2)
+                for px, py in points:
+                    draw.ellipse((px - 3, py - 3, px + 3, py + 3), fill="#ffcc00")
+
+    def toggle_metrics_overlay(self):
+        self._show_metrics = not self._show_metrics
+
+    def _draw_metrics(self, image, now):
+        """Tempi per stadio, frame scartati e code sopra il video, ricalcolati due volte al secondo"""
+        lines, computed = self._metrics_lines
+        if now - computed > 0.5:
+            lines = self.engine.metrics.overlay_lines()
+            self._metrics_lines = (lines, now)
+        if not lines:
             return
-            
-        try:
-            # Resize frame for faster processing
-            frame = cv2.resize(frame, (320, 240), interpolation=cv2.INTER_LINEAR)
-            results = self.model(frame)[0]
-            detected_objects_temp = []
-
-            for box in results.boxes:
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                label = results.names[int(box.cls[0])]
-                conf = box.conf[0].item()
-                detected_objects_temp.append(label)
-                
-                # Disegna una sfera bianca dietro il testo
-                font = cv2.FONT_HERSHEY_SIMPLEX
-                text = f"{label} {conf:.2f}"
-                text_size = cv2.getTextSize(text, font, 0.5, 2)[0]
-                text_x, text_y = x1, y1 - 10
-                radius = max(text_size) // 2 + 5
-                cv2.circle(frame, (text_x + text_size[0] // 2, text_y - text_size[1] // 2), radius, (255, 255, 255), -1)
-                cv2.putText(frame, text, (text_x, text_y), font, 0.5, (0, 0, 0), 2)
-            
-            self.detected_objects = detected_objects_temp
-            
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            img = Image.fromarray(frame)
-            imgtk = ImageTk.PhotoImage(image=img)
-            self.label.imgtk = imgtk
-            self.label.configure(image=imgtk)
-            
-            if self.detected_objects:
-                objects_seen = ", ".join(set(self.detected_objects))
-                self.detected_label.config(text=f"{languages[self.lang]['detected_objects']}: {objects_seen}", fg="#00FF00")
-                self.save_to_db(self.detected_objects)
-            else:
-                self.detected_label.config(text=languages[self.lang]['no_objects_detected'], fg="#FF0000")
-        except Exception as e:
-            logging.error(f"Errore durante l'elaborazione del frame: {e}")
-        
-        # Registra il frame se la registrazione è attiva
-        if self.recording:
-            self.video_recorder.record_frame(frame)
-        
-        self._last_detection_time = current_time
-    
-    def save_to_db(self, objects):
-        if not objects:
+        draw = ImageDraw.Draw(image)
+        height = 14 * len(lines) + 10
+        draw.rectangle((0, 0, image.width, height), fill="#000000")
+        for index, line in enumerate(lines):
+            draw.text((8, 5 + 14 * index), line, fill="#00ff00")
+
+    def start_zone_edit(self):
+        self._zone_edit = {"source": None, "points": []}
+        self.update_chat("Clicca sul video per aggiungere i vertici della zona, tasto destro o Invio per "
+                         "confermare, Esc per annullare")
+
+    def _on_zone_click(self, event):
+        if self._zone_edit is None:
             return
-            
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        # Usa executemany per inserimenti multipli
-        self.cursor.executemany(
-            "INSERT INTO detections (timestamp, object) VALUES (?, ?)",
-            [(timestamp, obj) for obj in set(objects)]
-        )
-        self.conn.commit()
+        # Il label centra l'immagine: si passa alle coordinate dell'immagine e poi a quelle del frame
+        image_w, image_h = self._display_image_size
+        x = event.x - (self.label.winfo_width() - image_w) / 2
+        y = event.y - (self.label.winfo_height() - image_h) / 2
+        for source, (left, top, w, h) in self._display_layout.items():
+            if left <= x < left + w and top <= y < top + h:
+                if self._zone_edit["source"] not in (None, source):
+                    return  # Una zona appartiene a una sola sorgente
+                self._zone_edit["source"] = source
+                self._zone_edit["points"].append(((x - left) / w, (y - top) / h))
+                return
+
+    def _finish_zone(self, event=None):
+        if self._zone_edit is None:
+            return
+        source, points = self._zone_edit["source"], self._zone_edit["points"]
+        self._zone_edit = None
+        if len(points) < 3:
+            self.update_chat("Zona annullata: servono almeno tre vertici")
+            return
+        self.engine.roi.add(source, points)
+        save_config_section("roi", self.engine.roi.to_config())
+        self.update_chat(f"Zona aggiunta a {source}")
+
+    def _cancel_zone_edit(self, event=None):
+        if self._zone_edit is not None:
+            self._zone_edit = None
+            self.update_chat("Disegno della zona annullato")
+
+    def clear_zones(self):
+        """Cancella le zone delle sorgenti mostrate, che tornano ad essere analizzate per intero"""
+        for source in list(self._display_layout):
+            self.engine.roi.clear(source)
+        save_config_section("roi", self.engine.roi.to_config())
+        self.update_chat("Zone cancellate")
+
+    def add_video_source(self):
+        """Chiede indice webcam, URL RTSP o percorso di un file e lo aggiunge alla griglia"""
+        spec = simpledialog.askstring("Aggiungi Sorgente", "Indice webcam, URL rtsp:// o percorso del file:",
+                                      parent=self.root)
+        if spec:
+            name = self.engine.add_source(spec.strip())
+            self.update_chat(f"Sorgente aggiunta: {name}")
+
+    def close_video_sources(self):
+        self.engine.registry.close_all()
+        self.update_chat("Sorgenti aggiuntive chiuse")
 
+    def _render_packet(self, packet):
+        """Aggiorna i widget con un frame pronto, eseguito solo sul thread Tk"""
+        now = time.time()
+        self._source_frames[packet.source] = packet
+        # Le sorgenti senza frame recenti escono dalla griglia
+        for source in [name for name, p in self._source_frames.items() if now - p.timestamp > 2.0]:
+            del self._source_frames[source]
+        image = packet.image
+        self._display_layout = {}
+        if len(self._source_frames) > 1:
+            image = self._compose_grid(sorted(self._source_frames.items()))
+        else:
+            self._display_layout[packet.source] = (0, 0, image.width, image.height)
+        self._display_image_size = image.size
+        self._draw_zones(image)
+        if self._show_metrics:
+            self._draw_metrics(image, now)
+        imgtk = ImageTk.PhotoImage(image=image)
+        self.label.imgtk = imgtk
+        self.label.configure(image=imgtk)
+
+        labels = [det["label"] for p in self._source_frames.values() for det in p.detections]
+        if labels:
+            objects_seen = ", ".join(set(labels))
+            self.detected_label.config(text=f"{languages[self.lang]['detected_objects']}: {objects_seen}", fg="#00FF00")
+        else:
+            self.detected_label.config(text=languages[self.lang]['no_objects_detected'], fg="#FF0000")
+    
     def show_detected_objects(self):
         if self.detected_objects:
             objects_seen = ", ".join(set(self.detected_objects))
@@ -704,12 +2970,12 @@ class ObjectDetectionApp:
                 self.label.imgtk._PhotoImage__photo.write(file_path, format="png")
 
     def show_statistics(self):
-        self.cursor.execute("SELECT object, COUNT(*) FROM detections GROUP BY object")
-        stats = self.cursor.fetchall()
+        stats = self.engine.live_stats.snapshot()
         if stats:
             stats_message = "Statistiche degli oggetti rilevati:\n"
-            for obj, count in stats:
-                stats_message += f"{obj}: {count}\n"
+            for row in stats:
+                stats_message += (f"{row['object']}: {row['total']} ({row['last_minute']}/min, "
+                                  f"{row['last_hour']}/ora, picco {row['peak_concurrent']} insieme)\n")
         else:
             stats_message = "Nessun dato statistico disponibile."
         self.update_chat(stats_message)
@@ -717,8 +2983,7 @@ class ObjectDetectionApp:
     def export_statistics(self):
         """Esporta le statistiche in un file CSV."""
         try:
-            self.cursor.execute("SELECT object, COUNT(*) FROM detections GROUP BY object")
-            stats = self.cursor.fetchall()
+            stats = self.engine.live_stats.snapshot()
             if stats:
                 file_path = filedialog.asksaveasfilename(
                     defaultextension=".csv",
@@ -727,8 +2992,13 @@ class ObjectDetectionApp:
                 if file_path:
                     with open(file_path, 'w', newline='') as f:
                         writer = csv.writer(f)
-                        writer.writerow(['Oggetto', 'Conteggio'])
-                        writer.writerows(stats)
+                        writer.writerow(['Oggetto', 'Conteggio', 'Ultimo minuto', 'Ultima ora',
+                                         'Prima comparsa', 'Ultima comparsa', 'Picco contemporanei'])
+                        for row in stats:
+                            writer.writerow([row['object'], row['total'], row['last_minute'], row['last_hour'],
+                                             row['first_seen'] and datetime.fromtimestamp(row['first_seen']).isoformat(),
+                                             row['last_seen'] and datetime.fromtimestamp(row['last_seen']).isoformat(),
+                                             row['peak_concurrent']])
                     self.update_chat(f"Statistiche esportate in {file_path}")
             else:
                 messagebox.showinfo("Info", "Nessun dato statistico disponibile da esportare.")
@@ -741,6 +3011,11 @@ class ObjectDetectionApp:
         self.chat_text.delete(1.0, tk.END)
 
     def update_chat(self, message):
+        # I thread di lavoro non toccano mai i widget direttamente
+        if threading.current_thread() is not threading.main_thread():
+            self.ui.call(self.update_chat, message)
+            return
+
         # Limita la dimensione della chat
         MAX_LINES = 1000
         current_lines = self.chat_text.get("1.0", tk.END).count('\n')
@@ -795,13 +3070,13 @@ class ObjectDetectionApp:
 
     def toggle_recording(self):
         """Attiva/disattiva la registrazione video"""
-        if not self.recording:
-            self.video_recorder.start_recording()
-            self.recording = True
+        if not self.engine.recording:
+            self.engine.video_recorder.start_recording()
+            self.engine.recording = True
             self.update_chat("Registrazione video avviata")
         else:
-            self.video_recorder.stop_recording()
-            self.recording = False
+            self.engine.video_recorder.stop_recording()
+            self.engine.recording = False
             self.update_chat("Registrazione video terminata")
             
     def toggle_voice_control(self):
@@ -818,16 +3093,15 @@ class ObjectDetectionApp:
     def show_advanced_stats(self):
         """Mostra le statistiche avanzate"""
         try:
-            stats = AdvancedStats(self.conn)
-            fig = stats.generate_daily_report()
+            fig = self.stats.generate_daily_report()
             fig.show()
         except Exception as e:
             self.update_chat(f"Errore durante la generazione delle statistiche: {e}")
             
     def manage_alerts(self):
         """Gestisce le impostazioni delle allerte"""
-        if not hasattr(self, 'alert_system'):
-            self.alert_system = AlertSystem()
+        if self.engine.alert_system is None:
+            self.engine.enable_alerts()
             self.update_chat("Sistema di allerta attivato")
         else:
             self.update_chat("Sistema di allerta già attivo")
@@ -837,10 +3111,12 @@ class ObjectDetectionApp:
         try:
             data = {
                 'statistics': self._get_detection_stats(),
+                'details': self.engine.live_stats.snapshot(),
                 'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             }
             
             report_gen = ReportGenerator()
+            os.makedirs("reports", exist_ok=True)
             filename = f"reports/rico_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
             report_gen.generate_report(data, filename)
             self.update_chat(f"Report generato: {filename}")
@@ -851,40 +3127,196 @@ class ObjectDetectionApp:
         """Loop per il controllo vocale"""
         while self.voice_control_active:
             command = self.voice_assistant.listen()
-            if command:
+            if command in self.voice_assistant.commands.values():
+                self.ui.call(getattr(self, command))
+                if command == "show_statistics":
+                    # Risposta a voce letta dai contatori in memoria, senza interrogare il database
+                    self.voice_assistant.speak(self.engine.live_stats.summary())
+            elif command:
                 self.update_chat(f"Comando vocale riconosciuto: {command}")
                 
     def _get_detection_stats(self):
         """Recupera le statistiche di rilevamento"""
-        self.cursor.execute("""
-            SELECT object, COUNT(*) as count 
-            FROM detections 
-            GROUP BY object
-            ORDER BY count DESC
-        """)
-        return dict(self.cursor.fetchall())
+        return self.engine.live_stats.totals()
 
 class VideoRecorder:
-    def __init__(self):
-        self.recording = False
-        self.output = None
-        self.filename = None
-        
+    """Registrazione su un thread di codifica dedicato, a segmenti, con un pre-roll in memoria per sorgente"""
+    _FLUSH = object()  # Chiude i segmenti delle sorgenti che non registrano più
+    PREFIX = "rico_seg_"  # Solo i file con questo prefisso sono segmenti di questo registratore
+
+    def __init__(self, directory="recordings", fourcc="XVID", extension="avi", fps=20.0, segment_s=300,
+                 max_segments=50, preroll_s=5.0, alert_clip_s=10.0, preroll_quality=80, queue_size=64):
+        self.directory = directory
+        self.fourcc = fourcc
+        self.extension = extension
+        self.fps = float(fps)
+        self.segment_s = segment_s
+        self.max_segments = max_segments  # File tenuti nella cartella, 0 = nessun limite
+        self.preroll_s = preroll_s
+        self.alert_clip_s = alert_clip_s
+        self.preroll_quality = preroll_quality
+        self.recording = False  # Registrazione manuale di tutte le sorgenti
+        self.filename = None  # Ultimo segmento aperto
+        self.dropped = 0  # Frame persi perché il thread di codifica era indietro
+        self._clips = {}  # sorgente -> istante fino a cui registrare dopo un'allerta
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._last_queued = {}
+        self._segments = {}  # sorgente -> segmento aperto, usati solo dal thread di codifica
+        self._preroll = {}  # sorgente -> deque di (timestamp, JPEG)
+        # Sorgenti per cui tenere il pre-roll (None = tutte): serve solo alle regole che registrano
+        self.preroll_sources = set()
+        self._files = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(**config)
+
     def start_recording(self):
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.filename = f"recordings/rico_recording_{timestamp}.avi"
-        fourcc = cv2.VideoWriter_fourcc(*'XVID')
-        self.output = cv2.VideoWriter(self.filename, fourcc, 20.0, (640,480))
         self.recording = True
-        
-    def record_frame(self, frame):
-        if self.recording and self.output:
-            self.output.write(frame)
-            
+        self._ensure_thread()
+
     def stop_recording(self):
-        if self.output:
-            self.output.release()
-            self.recording = False
+        self.recording = False
+        if self._thread is not None:
+            self._queue.put(self._FLUSH)
+
+    def trigger(self, source, seconds=None):
+        """Registra la sorgente per i prossimi secondi, preceduti dal pre-roll già in memoria"""
+        until = time.time() + (seconds or self.alert_clip_s)
+        self._clips[source] = max(self._clips.get(source, 0), until)
+        self._ensure_thread()
+
+    def close(self):
+        """Chiude i file aperti dopo aver codificato i frame ancora in coda"""
+        self.recording = False
+        self._clips.clear()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5.0)
+            self._thread = None
+
+    def queued(self):
+        return self._queue.qsize()
+
+    def _active(self, source, timestamp):
+        return self.recording or self._clips.get(source, 0) > timestamp
+
+    def _keeps_preroll(self, source):
+        return self.preroll_s > 0 and (self.preroll_sources is None or source in self.preroll_sources)
+
+    def record_frame(self, frame, source="webcam", timestamp=None):
+        """Accoda una copia del frame BGR per il thread di codifica, senza mai bloccare il chiamante"""
+        timestamp = timestamp or time.time()
+        # Senza registrazione né regole che registrano non si copia e non si codifica nulla
+        if not (self._keeps_preroll(source) or self._active(source, timestamp)):
+            return
+        # Il file ha una cadenza fissa: i frame in eccesso non vanno nemmeno copiati
+        if timestamp - self._last_queued.get(source, 0) < 1.0 / self.fps:
+            return
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait((source, timestamp, frame.copy()))
+            self._last_queued[source] = timestamp
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._encode_loop, name="rico-registrazione", daemon=True)
+                self._thread.start()
+
+    def _encode_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if item is self._FLUSH:
+                now = time.time()
+                for source in [s for s in self._segments if not self._active(s, now)]:
+                    self._close_segment(source)
+                continue
+            source, timestamp, frame = item
+            try:
+                if self._active(source, timestamp):
+                    self._write(source, timestamp, frame)
+                else:
+                    self._close_segment(source)
+                    if self._keeps_preroll(source):
+                        self._buffer(source, timestamp, frame)
+            except Exception as e:
+                logging.error(f"Errore durante la registrazione di {source}: {e}")
+        for source in list(self._segments):
+            self._close_segment(source)
+
+    def _buffer(self, source, timestamp, frame):
+        # In memoria il pre-roll resta compresso: pochi MB anche a piena risoluzione
+        ok, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.preroll_quality])
+        if not ok:
+            return
+        frames = self._preroll.setdefault(source, deque())
+        frames.append((timestamp, jpeg))
+        while timestamp - frames[0][0] > self.preroll_s:
+            frames.popleft()
+
+    def _write(self, source, timestamp, frame):
+        segment = self._segments.get(source)
+        if segment is not None and timestamp - segment["start"] >= self.segment_s:
+            self._close_segment(source)
+            segment = None
+        if segment is None:
+            preroll = self._preroll.pop(source, ())
+            start = preroll[0][0] if preroll else timestamp
+            segment = self._open_segment(source, start, frame.shape)
+            # Il segmento inizia con i secondi precedenti all'avvio della registrazione
+            for preroll_ts, jpeg in preroll:
+                self._append(segment, preroll_ts, cv2.imdecode(jpeg, cv2.IMREAD_COLOR))
+        self._append(segment, timestamp, frame)
+
+    def _append(self, segment, timestamp, frame):
+        if (frame.shape[1], frame.shape[0]) != segment["size"]:
+            frame = cv2.resize(frame, segment["size"])
+        # Cadenza costante: il frame si ripete o si salta in base al timestamp, così la durata è reale.
+        # Le pause oltre il secondo vengono accorciate per non riempire il file di frame uguali.
+        target = int((timestamp - segment["start"]) * self.fps) + 1
+        for _ in range(min(target - segment["frames"], int(self.fps))):
+            segment["writer"].write(frame)
+        segment["frames"] = max(segment["frames"], target)
+
+    def _open_segment(self, source, start, shape):
+        os.makedirs(self.directory, exist_ok=True)
+        safe_source = "".join(c if c.isalnum() else "_" for c in source)
+        stamp = datetime.fromtimestamp(start).strftime("%Y%m%d_%H%M%S")
+        self.filename = os.path.join(self.directory, f"{self.PREFIX}{safe_source}_{stamp}.{self.extension}")
+        size = (shape[1], shape[0])
+        writer = cv2.VideoWriter(self.filename, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, size)
+        self._segments[source] = {"writer": writer, "start": start, "size": size, "frames": 0}
+        self._rotate(self.filename)
+        return self._segments[source]
+
+    def _close_segment(self, source):
+        segment = self._segments.pop(source, None)
+        if segment is not None:
+            segment["writer"].release()
+
+    def _rotate(self, filename):
+        """Elimina i segmenti più vecchi oltre max_segments, contando anche quelli delle sessioni precedenti
+
+        Le registrazioni manuali della vecchia versione e gli altri file della cartella non si toccano.
+        """
+        if self._files is None:
+            existing = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                        if name.startswith(self.PREFIX) and name.endswith("." + self.extension)]
+            self._files = deque(sorted((f for f in existing if f != filename), key=os.path.getmtime))
+        self._files.append(filename)
+        while self.max_segments and len(self._files) > self.max_segments:
+            oldest = self._files.popleft()
+            try:
+                os.remove(oldest)
+            except OSError as e:
+                logging.error(f"Impossibile eliminare il segmento {oldest}: {e}")
 
 class VoiceAssistant:
     def __init__(self):
@@ -894,8 +3326,21 @@ class VoiceAssistant:
             "avvia riconoscimento": "start_detection",
             "ferma riconoscimento": "stop_detection",
             "cosa vedi": "show_detected_objects",
+            "statistiche": "show_statistics",
             "modalità notte": "toggle_night_mode"
         }
+
+    def process_command(self, text):
+        """Nome del metodo dell'app associato alla frase, oppure il testo riconosciuto"""
+        text = text.lower()
+        for phrase, method in self.commands.items():
+            if phrase in text:
+                return method
+        return text
+
+    def speak(self, text):
+        self.engine.say(text)
+        self.engine.runAndWait()
         
     def listen(self):
         with sr.Microphone() as source:
@@ -907,52 +3352,231 @@ class VoiceAssistant:
                 return "Non ho capito il comando"
 
 class AdvancedStats:
-    def __init__(self, db_connection):
+    """Statistiche dalle tabelle di aggregazione, lette a blocchi e con una cache invalidata dalle scritture"""
+    # (tabella, secondi per riga, intervallo massimo per cui è la scelta giusta)
+    RESOLUTIONS = (
+        ("detections_minute", 60, 6 * 3600),
+        ("detections_hour", 3600, 62 * 86400),
+        ("detections_day", 86400, None)
+    )
+
+    def __init__(self, db_connection, data_version=None, max_points=500, chunk_size=2000, cache_size=16):
         self.conn = db_connection
-        
-    def generate_daily_report(self):
-        query = """
-        SELECT 
-            date(timestamp) as date,
-            object,
-            COUNT(*) as count
-        FROM detections
-        GROUP BY date(timestamp), object
-        ORDER BY date
-        """
-        df = pd.read_sql_query(query, self.conn)
-        
-        fig = px.line(df, x='date', y='count', color='object',
-                     title='Rilevamenti Giornalieri per Oggetto')
+        self.data_version = data_version or (lambda: 0)  # Cambia a ogni scrittura nel database
+        self.max_points = max_points  # Punti per serie: oltre, i bucket vengono accorpati in SQL
+        self.chunk_size = chunk_size
+        self.cache_size = cache_size
+        self._cache = {}
+        self._cache_version = None
+
+    def _cached(self, key, compute):
+        version = self.data_version()
+        if version != self._cache_version:
+            self._cache.clear()
+            self._cache_version = version
+        if key not in self._cache:
+            if len(self._cache) >= self.cache_size:
+                self._cache.pop(next(iter(self._cache)))
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def _rows(self, query, params=()):
+        """Righe lette a blocchi: in memoria non c'è mai più di un blocco alla volta"""
+        cursor = self.conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(self.chunk_size)
+            if not rows:
+                return
+            yield from rows
+
+    def _range(self, start, end):
+        if start is None or end is None:
+            first, last = self.conn.execute("SELECT MIN(bucket), MAX(bucket) FROM detections_day").fetchone()
+            now = int(time.time())
+            start = start if start is not None else (first if first is not None else now)
+            end = end if end is not None else now
+        return int(start), int(end)
+
+    def _table(self, start, end):
+        for table, seconds, max_span in self.RESOLUTIONS:
+            if max_span is None or end - start <= max_span:
+                return table, seconds
+
+    def series(self, start=None, end=None):
+        """{oggetto: ([bucket], [conteggi])} con al più max_points punti per oggetto"""
+        # La chiave usa l'intervallo richiesto: "fino ad ora" resta valido finché non arrivano scritture
+        return self._cached(("series", start, end), lambda: self._series(*self._range(start, end)))
+
+    def _series(self, start, end):
+        table, seconds = self._table(start, end)
+        # Accorpamento dei bucket in SQL, così il numero di righe lette non dipende dai dati
+        step = max(seconds, seconds * math.ceil((end - start) / seconds / self.max_points))
+        series = {}
+        for bucket, obj, count in self._rows(
+                f"SELECT bucket - (bucket - ?) % ? AS step_bucket, object, SUM(count) FROM {table} "
+                "WHERE bucket BETWEEN ? AND ? GROUP BY step_bucket, object ORDER BY step_bucket",
+                (start, step, start, end)):
+            buckets, counts = series.setdefault(obj, ([], []))
+            buckets.append(bucket)
+            counts.append(count)
+        return series
+
+    def generate_daily_report(self, start=None, end=None):
+        """Grafico a linee dalle serie aggregate, senza leggere le singole righe dei rilevamenti"""
+        series = self.series(start, end)
+        fig = go.Figure()
+        for obj, (buckets, counts) in sorted(series.items()):
+            fig.add_trace(go.Scatter(x=[datetime.fromtimestamp(bucket) for bucket in buckets], y=counts,
+                                     mode="lines", name=obj))
+        fig.update_layout(title="Rilevamenti per Oggetto", xaxis_title="data", yaxis_title="conteggio")
         return fig
 
+def point_in_polygon(x, y, polygon):
+    """Ray casting su una lista di vertici (x, y)"""
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        xi, yi = polygon[i]
+        xj, yj = polygon[j]
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+class AlertRule:
+    """Regola d'allerta: classe, confidenza minima, zona, permanenza minima e pausa tra due allerte"""
+    def __init__(self, label, message=None, name=None, min_confidence=0.0, zone=None, dwell_s=0.0,
+                 cooldown_s=30.0, sources=None, record=False, clip_s=None, sound=True):
+        self.label = label
+        self.name = name or label
+        self.message = message or f"{label} rilevato!"
+        self.min_confidence = min_confidence
+        # Vertici in coordinate normalizzate 0-1, così la stessa zona vale a qualunque risoluzione
+        self.zone = [tuple(point) for point in zone] if zone else None
+        self.dwell_s = dwell_s
+        self.cooldown_s = cooldown_s
+        self.sources = set(sources) if sources else None
+        self.record = record  # Solo le regole che lo chiedono avviano una clip
+        self.clip_s = clip_s  # None = durata predefinita del registratore
+        self.sound = sound
+        self._zones = {}  # (larghezza, altezza) -> (riquadro, vertici in pixel)
+
+    def _zone_for(self, frame_size):
+        zone = self._zones.get(frame_size)
+        if zone is None:
+            w, h = frame_size
+            polygon = [(x * w, y * h) for x, y in self.zone]
+            xs, ys = [x for x, _ in polygon], [y for _, y in polygon]
+            zone = self._zones[frame_size] = ((min(xs), min(ys), max(xs), max(ys)), polygon)
+        return zone
+
+    def matches(self, det, source, frame_size):
+        if det["confidence"] < self.min_confidence:
+            return False
+        if self.sources is not None and source not in self.sources:
+            return False
+        if self.zone is None:
+            return True
+        (x1, y1, x2, y2), polygon = self._zone_for(frame_size)
+        box = det["box"]
+        cx, cy = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+        # Il riquadro della zona scarta subito quasi tutti i rilevamenti, il poligono solo quelli vicini
+        return x1 <= cx <= x2 and y1 <= cy <= y2 and point_in_polygon(cx, cy, polygon)
+
 class AlertSystem:
-    def __init__(self):
+    """Valuta le regole d'allerta sui rilevamenti tracciati di ogni frame"""
+    def __init__(self, sound=True, rules=None):
         self.alert_objects = {
             "person": "Persona rilevata!",
             "knife": "⚠️ Oggetto pericoloso rilevato!",
             "fire": "🔥 Incendio rilevato!"
         }
-        pygame.mixer.init()
-        self.alert_sound = pygame.mixer.Sound("assets/alert.wav")
-        
-    def check_alerts(self, detected_objects):
+        if rules is None:
+            # Una persona è spesso in scena: registrare anche per lei vorrebbe dire registrare quasi sempre
+            rules = [{"label": label, "message": message, "record": label != "person"}
+                     for label, message in self.alert_objects.items()]
+        self.rules = [AlertRule(**rule) for rule in rules]
+        # Regole raggruppate per classe: ogni rilevamento guarda solo quelle della propria etichetta
+        self._by_label = {}
+        for index, rule in enumerate(self.rules):
+            self._by_label.setdefault(rule.label, []).append((index, rule))
+        self._states = {}  # (regola, sorgente, track_id) -> [inizio della condizione, allerta già data]
+        self._last_fired = {}  # (regola, sorgente) -> istante dell'ultima allerta
+        self.alert_sound = None
+        if sound:
+            # Sui server senza scheda audio le allerte restano solo testuali
+            try:
+                pygame.mixer.init()
+                self.alert_sound = pygame.mixer.Sound("assets/alert.wav")
+            except Exception as e:
+                logging.error(f"Audio delle allerte non disponibile: {e}")
+
+    @classmethod
+    def from_config(cls, config, sound=True):
+        return cls(sound=sound, rules=config["rules"])
+
+    def recording_sources(self):
+        """Sorgenti su cui una regola può avviare una clip (None = tutte), per il pre-roll del registratore"""
+        sources = set()
+        for rule in self.rules:
+            if rule.record:
+                if rule.sources is None:
+                    return None
+                sources |= rule.sources
+        return sources
+
+    def evaluate(self, source, detections, frame_size, now):
+        """Restituisce (allerte nuove, registrare?, durata della clip) per i rilevamenti di un frame"""
         alerts = []
-        for obj in detected_objects:
-            if (obj in self.alert_objects):
+        record, clip = False, None
+        matched = set()
+        for det in detections:
+            for index, rule in self._by_label.get(det["label"], ()):
+                if not rule.matches(det, source, frame_size):
+                    continue
+                key = (index, source, det.get("track_id"))
+                matched.add(key)
+                state = self._states.get(key)
+                if state is None:
+                    state = self._states[key] = [now, False]
+                if now - state[0] < rule.dwell_s:
+                    continue
+                # Finché la condizione resta vera la registrazione viene prolungata
+                if rule.record:
+                    record = True
+                    if rule.clip_s:
+                        clip = max(clip or 0, rule.clip_s)
+                if state[1]:
+                    continue
+                state[1] = True  # Una sola allerta per oggetto, anche se resta a lungo
+                if now - self._last_fired.get((index, source), float("-inf")) < rule.cooldown_s:
+                    continue
+                self._last_fired[(index, source)] = now
                 alerts.append({
                     "time": datetime.now().isoformat(),
-                    "object": obj,
-                    "message": self.alert_objects[obj]
+                    "object": det["label"],
+                    "message": rule.message,
+                    "rule": rule.name,
+                    "track_id": det.get("track_id"),
+                    "confidence": det["confidence"]
                 })
-                self.alert_sound.play()
-        return alerts
+                if rule.sound and self.alert_sound:
+                    self.alert_sound.play()
+        # Le condizioni non più vere ripartono da zero alla prossima occorrenza
+        stale = [key for key in self._states if key[1] == source and key not in matched]
+        for key in stale:
+            del self._states[key]
+        return alerts, record, clip
 
 class ReportGenerator:
     def __init__(self):
+        # reportlab viene importato solo quando si genera un report
+        from reportlab.lib.styles import getSampleStyleSheet
         self.styles = getSampleStyleSheet()
         
     def generate_report(self, data, output_file):
+        from reportlab.lib.pagesizes import letter
+        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
         doc = SimpleDocTemplate(output_file, pagesize=letter)
         story = []
         
@@ -965,9 +3589,941 @@ class ReportGenerator:
             text = f"{obj}: {count} rilevamenti"
             story.append(Paragraph(text, self.styles['Normal']))
 
+        # Dettagli dalle statistiche in memoria
+        if data.get('details'):
+            story.append(Spacer(1, 12))
+            story.append(Paragraph("Attività recente", self.styles['Heading2']))
+            for row in data['details']:
+                last_seen = datetime.fromtimestamp(row['last_seen']).strftime("%Y-%m-%d %H:%M") if row['last_seen'] else "-"
+                text = (f"{row['object']}: {row['last_hour']} nell'ultima ora, ultima comparsa {last_seen}, "
+                        f"al massimo {row['peak_concurrent']} contemporaneamente")
+                story.append(Paragraph(text, self.styles['Normal']))
+
+        doc.build(story)
+
+def decode_yolo_output(output, names, confidence=0.25, iou=0.45):
+    """Converte l'uscita grezza YOLOv8 (batch, 4 + classi, proposte) in rilevamenti dopo la NMS"""
+    all_detections = []
+    for prediction in output:
+        prediction = prediction.T
+        scores = prediction[:, 4:]
+        class_ids = scores.argmax(axis=1)
+        conf = scores[np.arange(len(scores)), class_ids]
+        keep = conf >= confidence
+        prediction, class_ids, conf = prediction[keep], class_ids[keep], conf[keep]
+        cx, cy, w, h = prediction[:, 0], prediction[:, 1], prediction[:, 2], prediction[:, 3]
+        boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+        # NMS per classe: ogni classe viene spostata in una zona distinta del piano
+        shifted = boxes + class_ids[:, None] * 4096.0
+        rects = [[float(x1), float(y1), float(x2 - x1), float(y2 - y1)] for x1, y1, x2, y2 in shifted]
+        indices = cv2.dnn.NMSBoxes(rects, conf.tolist(), confidence, iou) if rects else []
+        all_detections.append([
+            {"label": names[int(class_ids[i])], "confidence": float(conf[i]), "box": tuple(boxes[i].tolist())}
+            for i in np.array(indices, dtype=int).flatten()
+        ])
+    return all_detections
+
+class UltralyticsBackend:
+    """Modello YOLO eseguito da ultralytics/torch in modalità eager"""
+    name = "ultralytics"
+
+    def __init__(self, weights, threads=None, confidence=0.25, iou=0.45):
+        from ultralytics import YOLO
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        self.model = YOLO(weights)
+        # Stesse soglie dei backend ONNX: il benchmark confronta lo stesso lavoro e l'uscita non cambia
+        self.confidence = confidence
+        self.iou = iou
+
+    def predict(self, images, size):
+        detections = []
+        for results in self.model(images, imgsz=size, conf=self.confidence, iou=self.iou, verbose=False):
+            detections.append([
+                {"label": results.names[int(box.cls[0])], "confidence": box.conf[0].item(),
+                 "box": tuple(box.xyxy[0].tolist())}
+                for box in results.boxes
+            ])
+        return detections
+
+class OnnxRuntimeBackend:
+    """Modello esportato in ONNX ed eseguito da ONNX Runtime sulla CPU"""
+    name = "onnxruntime"
+
+    def __init__(self, onnx_path, names, threads=4, confidence=0.25, iou=0.45):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.names = names
+        self.confidence = confidence
+        self.iou = iou
+
+    def predict(self, images, size):
+        blob = cv2.dnn.blobFromImages(images, 1 / 255.0, (size, size), swapRB=True)
+        output = self.session.run(None, {self.input_name: blob})[0]
+        return decode_yolo_output(output, self.names, self.confidence, self.iou)
+
+class OpenVINOBackend:
+    """Modello ONNX compilato da OpenVINO per la CPU"""
+    name = "openvino"
+
+    def __init__(self, onnx_path, names, threads=4, confidence=0.25, iou=0.45):
+        import openvino as ov
+        core = ov.Core()
+        self.model = core.compile_model(onnx_path, "CPU", {"INFERENCE_NUM_THREADS": threads})
+        self.names = names
+        self.confidence = confidence
+        self.iou = iou
+
+    def predict(self, images, size):
+        blob = cv2.dnn.blobFromImages(images, 1 / 255.0, (size, size), swapRB=True)
+        output = self.model(blob)[self.model.output(0)]
+        return decode_yolo_output(output, self.names, self.confidence, self.iou)
+
+def export_onnx(weights, cache_dir, int8=False):
+    """Esporta una sola volta il modello in ONNX (e opzionalmente in int8) e lo tiene in cache su disco"""
+    os.makedirs(cache_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    onnx_path = os.path.join(cache_dir, f"{stem}.onnx")
+    names_path = os.path.join(cache_dir, f"{stem}.names.json")
+    if not (os.path.exists(onnx_path) and os.path.exists(names_path)):
+        from ultralytics import YOLO
+        model = YOLO(weights)
+        # Dimensioni dinamiche: servono al batch e alla risoluzione adattiva
+        exported = model.export(format="onnx", dynamic=True, simplify=True)
+        os.replace(exported, onnx_path)
+        with open(names_path, "w", encoding="utf-8") as f:
+            json.dump({int(k): v for k, v in model.names.items()}, f)
+    with open(names_path, encoding="utf-8") as f:
+        names = {int(k): v for k, v in json.load(f).items()}
+    if not int8:
+        return onnx_path, names
+    int8_path = os.path.join(cache_dir, f"{stem}.int8.onnx")
+    if not os.path.exists(int8_path):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QUInt8)
+    return int8_path, names
+
+def create_backend(name, config):
+    threads = config["threads"]
+    if name == "ultralytics":
+        return UltralyticsBackend(config["weights"], threads, confidence=config["confidence"], iou=config["iou"])
+    onnx_path, names = export_onnx(config["weights"], config["cache_dir"], int8=name.endswith("-int8"))
+    options = dict(threads=threads, confidence=config["confidence"], iou=config["iou"])
+    if name.startswith("onnxruntime"):
+        backend = OnnxRuntimeBackend(onnx_path, names, **options)
+    elif name == "openvino":
+        backend = OpenVINOBackend(onnx_path, names, **options)
+    else:
+        raise ValueError(f"Backend di inferenza sconosciuto: {name}")
+    backend.name = name
+    return backend
+
+def benchmark_backend(backend, size=320, runs=5):
+    """Latenza mediana di una chiamata su un frame sintetico, dopo un giro di riscaldamento"""
+    image = np.random.randint(0, 255, (size, size, 3), dtype=np.uint8)
+    backend.predict([image], size)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        backend.predict([image], size)
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2]
+
+def backend_choice_key(config):
+    """Cosa invalida la scelta salvata: pesi (e loro modifica), thread e candidati"""
+    weights = config["weights"]
+    mtime = os.path.getmtime(weights) if os.path.exists(weights) else None
+    return {"weights": os.path.abspath(weights), "mtime": mtime, "threads": config["threads"],
+            "candidates": list(config["candidates"])}
+
+def load_backend_choice(config):
+    """Backend scelto da un benchmark precedente con la stessa chiave, altrimenti None"""
+    path = os.path.join(config["cache_dir"], "backend.json")
+    try:
+        with open(path, encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if saved.get("key") != backend_choice_key(config) or saved.get("backend") not in config["candidates"]:
+        return None
+    return saved["backend"]
+
+def save_backend_choice(config, name, latency):
+    try:
+        os.makedirs(config["cache_dir"], exist_ok=True)
+        with open(os.path.join(config["cache_dir"], "backend.json"), "w", encoding="utf-8") as f:
+            json.dump({"key": backend_choice_key(config), "backend": name, "latency_ms": latency * 1000}, f)
+    except OSError as e:
+        logging.error(f"Impossibile salvare il backend scelto: {e}")
+
+def load_inference_backend(config=None):
+    """Crea il backend configurato oppure, in modalità auto, il più veloce tra quelli disponibili"""
+    config = config or load_config()["inference"]
+    if config["backend"] != "auto":
+        with startup_profile.measure(f"backend {config['backend']}"):
+            return create_backend(config["backend"], config)
+
+    # Il benchmark importa e costruisce ogni candidato: si rifà solo se la scelta salvata non vale più
+    cached = load_backend_choice(config)
+    if cached is not None:
+        try:
+            with startup_profile.measure(f"backend {cached}"):
+                return create_backend(cached, config)
+        except Exception as e:
+            logging.info(f"Backend salvato {cached} non più disponibile, nuovo benchmark: {e}")
+
+    best, best_time = None, None
+    for name in config["candidates"]:
+        try:
+            with startup_profile.measure(f"backend {name}"):
+                backend = create_backend(name, config)
+                latency = benchmark_backend(backend, runs=config["benchmark_runs"])
+        except Exception as e:
+            # Dipendenza mancante o esportazione fallita: si prova il candidato successivo
+            logging.info(f"Backend {name} non disponibile: {e}")
+            continue
+        logging.info(f"Backend {name}: {latency * 1000:.1f} ms per frame")
+        if best is None or latency < best_time:
+            best, best_time = backend, latency
+    if best is None:
+        raise RuntimeError("Nessun backend di inferenza disponibile")
+    logging.info(f"Backend di inferenza scelto: {best.name}")
+    save_backend_choice(config, best.name, best_time)
+    return best
+
+def open_camera(index=0):
+    with startup_profile.measure("apertura webcam"):
+        return cv2.VideoCapture(index)
+
+def prepare_database(db_path=DB_PATH):
+    """Crea o migra lo schema con una connessione usa e getta, così il thread Tk non attende"""
+    with startup_profile.measure("database"):
+        conn = sqlite3.connect(db_path)
+        try:
+            init_schema(conn)
+            ObjectTracker.continue_ids(conn.execute("SELECT MAX(track_id) FROM detections").fetchone()[0])
+        finally:
+            conn.close()
+
+class StartupLoader:
+    """Esegue in parallelo i compiti lenti dell'avvio e ne espone il reale avanzamento"""
+    def __init__(self, tasks):
+        self.tasks = tasks  # Lista di (nome, peso, funzione)
+        self.results = {}
+        self.errors = {}
+        self._done = set()
+        self._lock = threading.Lock()
+
+    def start(self):
+        for name, _, func in self.tasks:
+            threading.Thread(target=self._run, args=(name, func), daemon=True).start()
+
+    def _run(self, name, func):
+        try:
+            result = func()
+            with self._lock:
+                self.results[name] = result
+        except Exception as e:
+            logging.error(f"Errore durante l'avvio ({name}): {e}")
+            with self._lock:
+                self.errors[name] = e
+        finally:
+            with self._lock:
+                self._done.add(name)
+
+    def progress(self):
+        """Percentuale completata, pesata sul costo atteso di ciascun compito"""
+        total = sum(weight for _, weight, _ in self.tasks)
+        with self._lock:
+            done = sum(weight for name, weight, _ in self.tasks if name in self._done)
+        return 100.0 * done / total if total else 100.0
+
+    def pending(self):
+        with self._lock:
+            return [name for name, _, _ in self.tasks if name not in self._done]
+
+    def finished(self):
+        return not self.pending()
+
+def websocket_frame(payload, opcode=0x1):
+    """Codifica un frame WebSocket dal server (mai mascherato)"""
+    header = bytearray([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header.append(length)
+    elif length < 65536:
+        header.append(126)
+        header += length.to_bytes(2, "big")
+    else:
+        header.append(127)
+        header += length.to_bytes(8, "big")
+    return bytes(header) + payload
+
+class DetectionServer:
+    """API locale asyncio: rilevamenti in JSON, eventi via WebSocket e frame annotati in MJPEG"""
+    WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+    CLIENT_QUEUE_SIZE = 256  # Eventi in attesa per client, oltre si scartano per i client lenti
+
+    def __init__(self, engine, host="127.0.0.1", port=8765, jpeg_quality=80, stream_width=1280, **_):
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.jpeg_quality = jpeg_quality
+        self.stream_width = stream_width
+        self._latest = {}  # sorgente -> rilevamenti correnti in formato JSON
+        self._jpeg = {}  # sorgente -> (versione, byte JPEG), codificato una volta e condiviso
+        self._mjpeg_clients = 0
+        self._ws_clients = set()
+        self._loop = None
+        self._frame_cond = None
+        self._stop_event = None
+        self._thread = None
+        engine.frame_listeners.append(self.publish_frame)
+        engine.event_listeners.append(self.publish_events)
+        engine.alert_listeners.append(self.publish_alert)
+
+    def start(self):
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._main()), name="rico-server", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._loop and self._stop_event:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+        if self._thread:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._frame_cond = asyncio.Condition()
+        self._stop_event = asyncio.Event()
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        logging.info(f"API locale in ascolto su http://{self.host}:{self.port}")
+        async with server:
+            await self._stop_event.wait()
+
+    # --- Chiamati dai thread della pipeline ---
+
+    def publish_frame(self, packet):
+        # Copia e sostituzione: il loop asyncio serializza self._latest mentre questo thread pubblica
+        latest = dict(self._latest)
+        latest[packet.source] = {
+            "timestamp": packet.timestamp,
+            "detections": [
+                {"label": det["label"], "confidence": round(det["confidence"], 3),
+                 "box": list(det["box"]), "track_id": det.get("track_id")}
+                for det in packet.detections
+            ]
+        }
+        self._latest = latest
+        if self._mjpeg_clients == 0 or self._loop is None:
+            return
+        # Una sola codifica per frame, qualunque sia il numero di client collegati
+        frame = packet.frame
+        h, w = frame.shape[:2]
+        if w > self.stream_width:
+            frame = cv2.resize(frame, (self.stream_width, int(h * self.stream_width / w)),
+                               interpolation=cv2.INTER_AREA)
+        ok, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if ok:
+            self._loop.call_soon_threadsafe(self._set_jpeg, packet.source, jpeg.tobytes())
+
+    def publish_events(self, events, source):
+        for event in events:
+            self._broadcast({"type": "track", "source": source, "event": event["event"],
+                             "track_id": event["track_id"], "label": event["label"],
+                             "confidence": round(event["confidence"], 3), "box": list(event["box"]),
+                             "ts": time.time()})
+
+    def publish_alert(self, alert):
+        self._broadcast(dict(alert, type="alert"))
+
+    def _broadcast(self, message):
+        if self._loop is not None and self._ws_clients:
+            data = websocket_frame(json.dumps(message).encode("utf-8"))
+            self._loop.call_soon_threadsafe(self._fanout, data)
+
+    # --- Eseguiti sul loop asyncio ---
+
+    def _set_jpeg(self, source, data):
+        version = self._jpeg.get(source, (0, None))[0] + 1
+        self._jpeg[source] = (version, data)
+        self._loop.create_task(self._notify_frame())
+
+    async def _notify_frame(self):
+        async with self._frame_cond:
+            self._frame_cond.notify_all()
+
+    def _fanout(self, data):
+        for client in self._ws_clients:
+            try:
+                client.put_nowait(data)
+            except asyncio.QueueFull:
+                pass
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+            lines = request.decode("latin-1").split("\r\n")
+            method, target, _ = lines[0].split(" ", 2)
+            headers = {}
+            for line in lines[1:]:
+                if ":" in line:
+                    key, value = line.split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+            path, _, query = target.partition("?")
+            params = dict(item.split("=", 1) for item in query.split("&") if "=" in item)
+
+            if method != "GET":
+                await self._send(writer, 405, b"Metodo non supportato")
+            elif path == "/detections":
+                body = json.dumps(self._latest).encode("utf-8")
+                await self._send(writer, 200, body, "application/json")
+            elif path == "/stats":
+                body = json.dumps(self.engine.live_stats.snapshot()).encode("utf-8")
+                await self._send(writer, 200, body, "application/json")
+            elif path == "/metrics":
+                body = self.engine.metrics.render().encode("utf-8")
+                await self._send(writer, 200, body, "text/plain; version=0.0.4; charset=utf-8")
+            elif path == "/events" and headers.get("upgrade", "").lower() == "websocket":
+                await self._websocket(reader, writer, headers)
+            elif path == "/stream.mjpg":
+                await self._mjpeg(writer, params.get("source"))
+            else:
+                await self._send(writer, 404, b"Non trovato")
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send(self, writer, status, body, content_type="text/plain; charset=utf-8"):
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}[status]
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+
+    async def _mjpeg(self, writer, source):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: multipart/x-mixed-replace; boundary=frame\r\n"
+                     b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+        self._mjpeg_clients += 1
+        sent = 0
+        try:
+            while not self._stop_event.is_set():
+                async with self._frame_cond:
+                    await self._frame_cond.wait()
+                # Senza sorgente indicata si segue la prima che ha prodotto un frame
+                name = source or next(iter(self._jpeg), None)
+                version, data = self._jpeg.get(name, (0, None))
+                if data is None or version == sent:
+                    continue
+                sent = version
+                writer.write(b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: "
+                             + str(len(data)).encode() + b"\r\n\r\n" + data + b"\r\n")
+                await writer.drain()
+        finally:
+            self._mjpeg_clients -= 1
+
+    async def _websocket(self, reader, writer, headers):
+        key = headers.get("sec-websocket-key")
+        if not key:
+            await self._send(writer, 400, b"Sec-WebSocket-Key mancante")
+            return
+        accept = base64.b64encode(hashlib.sha1((key + self.WEBSOCKET_GUID).encode("latin-1")).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+        outgoing = asyncio.Queue(maxsize=self.CLIENT_QUEUE_SIZE)
+        self._ws_clients.add(outgoing)
+        receiver = asyncio.ensure_future(self._websocket_receive(reader, outgoing))
+        try:
+            while True:
+                data = await outgoing.get()
+                if data is None:
+                    break
+                writer.write(data)
+                await writer.drain()
+        finally:
+            self._ws_clients.discard(outgoing)
+            receiver.cancel()
+
+    async def _websocket_receive(self, reader, outgoing):
+        """Legge i frame del client solo per gestire ping e chiusura"""
+        try:
+            while True:
+                head = await reader.readexactly(2)
+                opcode, length = head[0] & 0x0F, head[1] & 0x7F
+                if length == 126:
+                    length = int.from_bytes(await reader.readexactly(2), "big")
+                elif length == 127:
+                    length = int.from_bytes(await reader.readexactly(8), "big")
+                mask = await reader.readexactly(4) if head[1] & 0x80 else b"\0\0\0\0"
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(await reader.readexactly(length)))
+                if opcode == 0x8:
+                    break
+                if opcode == 0x9 and not outgoing.full():
+                    outgoing.put_nowait(websocket_frame(payload, opcode=0xA))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        # Sveglia il ciclo di invio anche se la coda è piena
+        while outgoing.full():
+            outgoing.get_nowait()
+        outgoing.put_nowait(None)
+
+class BatchProcessor:
+    """Elaborazione offline di video e cartelle di immagini alla massima velocità, senza limiti di tempo reale"""
+    IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+    def __init__(self, inputs, config=None, output=None, batch_size=8, stride=1, workers=4, db_path=DB_PATH):
+        self.inputs = inputs
+        self.config = config or load_config()
+        self.output = output  # None = database, altrimenti file .csv o .parquet
+        self.batch_size = batch_size
+        self.stride = max(1, stride)  # Analizza un frame ogni stride
+        self.workers = workers  # Decodifiche contemporanee
+        self.db_path = db_path
+        self.frames = 0
+        self.media_seconds = 0.0
+        self._media_lock = threading.Lock()
+
+    def run(self):
+        start = time.perf_counter()
+        self.model = load_inference_backend(self.config["inference"])
+        # Risoluzione fissa: in batch conta la produttività, non la latenza
+        self.preprocessor = Preprocessor.from_config(dict(self.config["preprocess"], mode="fixed"))
+        self.trackers = {}
+        self._open_output()
+
+        # Coda bloccante: in batch nessun frame viene scartato, i decoder aspettano il modello
+        frames = queue.Queue(maxsize=self.batch_size * 4)
+        slots = threading.Semaphore(self.workers)
+        # Un nome per ingresso: con lo stesso nome due file condividerebbero tracker e sorgente nel database
+        names = set()
+        for path in self.inputs:
+            source = unique_source_name(f"batch:{os.path.basename(os.path.normpath(path))}", names)
+            names.add(source)
+            threading.Thread(target=self._decode, args=(path, source, frames, slots), daemon=True).start()
+
+        remaining = len(self.inputs)
+        batch = []
+        while remaining:
+            source, frame, ts = frames.get()
+            if frame is None:
+                # Fine sorgente: prima si elaborano i suoi frame ancora in attesa, poi si chiudono le tracce
+                self._infer(batch)
+                batch = []
+                tracker = self.trackers.pop(source, None)
+                if tracker:
+                    self._write(detection_rows(tracker.close(), source, ts))
+                remaining -= 1
+                continue
+            batch.append((source, frame, ts))
+            if len(batch) >= self.batch_size:
+                self._infer(batch)
+                batch = []
+        self._close_output()
+
+        elapsed = time.perf_counter() - start
+        report = f"Elaborati {self.frames} frame in {elapsed:.1f} s ({self.frames / elapsed:.1f} frame/s"
+        # Le immagini non hanno una durata: il confronto con il tempo reale vale solo per i soli video
+        if not any(os.path.isdir(path) for path in self.inputs):
+            speed = self.media_seconds / elapsed if elapsed else 0.0
+            report += f", {speed:.1f}x tempo reale"
+        report += ")"
+        print(report)
+        logging.info(report)
+
+    def _decode(self, path, source, frames, slots):
+        """Decodifica in anticipo una sorgente, in un thread dedicato"""
+        ts = time.time()
+        with slots:
+            try:
+                if os.path.isdir(path):
+                    # Prima il filtro sulle estensioni: gli altri file non devono spostare il passo
+                    images = [name for name in sorted(os.listdir(path))
+                              if name.lower().endswith(self.IMAGE_EXTENSIONS)]
+                    for name in images[::self.stride]:
+                        file_path = os.path.join(path, name)
+                        frame = cv2.imread(file_path)
+                        if frame is not None:
+                            ts = os.path.getmtime(file_path)
+                            frames.put((source, frame, ts))
+                else:
+                    cap = cv2.VideoCapture(path)
+                    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+                    total = cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0
+                    # Senza altre informazioni la registrazione si considera terminata alla modifica del file
+                    start_ts = os.path.getmtime(path) - total / fps
+                    index = 0
+                    try:
+                        while True:
+                            # grab() senza decodifica per i frame da saltare
+                            if index % self.stride and cap.grab():
+                                index += 1
+                                continue
+                            ret, frame = cap.read()
+                            if not ret:
+                                break
+                            ts = start_ts + index / fps
+                            frames.put((source, frame, ts))
+                            index += 1
+                    finally:
+                        cap.release()
+                    with self._media_lock:
+                        self.media_seconds += index / fps
+            except Exception as e:
+                logging.error(f"Errore durante la decodifica di {path}: {e}")
+            finally:
+                frames.put((source, None, ts))
+
+    def _infer(self, batch):
+        if not batch:
+            return
+        size = self.preprocessor.size
+        inputs, transforms = [], []
+        for _, frame, _ in batch:
+            image, transform = self.preprocessor.letterbox(frame, size)
+            inputs.append(image)
+            transforms.append(transform)
+        for (source, frame, ts), results, transform in zip(batch, self.model.predict(inputs, size), transforms):
+            for det in results:
+                det["box"] = Preprocessor.map_box(det["box"], transform, frame.shape)
+            tracker = self.trackers.get(source)
+            if tracker is None:
+                tracker = self.trackers[source] = ObjectTracker.from_config(self.config["tracking"])
+            _, events = tracker.update(results, ts)
+            self._write(detection_rows(events, source, ts))
+        self.frames += len(batch)
+
+    def _open_output(self):
+        self._rows = []
+        self._csv_file = None
+        if self.output is None:
+            prepare_database(self.db_path)
+            self._db_writer = DetectionWriter(self.db_path, batch_size=5000)
+            self._db_writer.start()
+        elif self.output.lower().endswith(".csv"):
+            self._csv_file = open(self.output, "w", newline="", encoding="utf-8")
+            self._csv = csv.writer(self._csv_file)
+            self._csv.writerow(ROW_COLUMNS)
+        elif not self.output.lower().endswith(".parquet"):
+            raise ValueError(f"Formato di uscita non supportato: {self.output}")
+
+    def _write(self, rows):
+        if not rows:
+            return
+        if self.output is None:
+            self._db_writer.add(rows)
+        elif self._csv_file:
+            self._csv.writerows(rows)
+        else:
+            self._rows.extend(rows)
+
+    def _close_output(self):
+        if self.output is None:
+            self._db_writer.close()
+        elif self._csv_file:
+            self._csv_file.close()
+        else:
+            pd.DataFrame(self._rows, columns=ROW_COLUMNS).to_parquet(self.output, index=False)
+
+def peak_rss_mb():
+    """Picco di memoria residente del processo, None dove resource non esiste (Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux misura in KB, macOS in byte
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+class Benchmark:
+    """Fa passare frame registrati o sintetici per ogni stadio e misura latenza, throughput e memoria"""
+    def __init__(self, config=None, inputs=None, frames=200, warmup=10, trace_frames=30, display_size=(960, 540)):
+        self.config = dict(config or load_config())
+        # Risoluzione fissa, altrimenti due esecuzioni non sono confrontabili
+        self.config["preprocess"] = dict(self.config["preprocess"], mode="fixed")
+        self.inputs = inputs or []
+        self.frames = frames
+        self.warmup = warmup
+        self.trace_frames = trace_frames  # Frame della seconda passata, con tracemalloc attivo
+        self.display_size = display_size
+        self.timings = {}
+        self.allocations = {}
+
+    @contextmanager
+    def _timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.setdefault(stage, []).append(time.perf_counter() - start)
+
+    @contextmanager
+    def _traced(self, stage):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            self.allocations.setdefault(stage, []).append(tracemalloc.get_traced_memory()[1] - base)
+
+    @contextmanager
+    def _untimed(self, stage):
+        yield
+
+    def _load_frames(self):
+        """Frame in memoria prima delle misure, così la decodifica non si somma agli altri stadi"""
+        frames = []
+        for path in self.inputs:
+            paths = [path]
+            if os.path.isdir(path):
+                paths = [os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if name.lower().endswith(BatchProcessor.IMAGE_EXTENSIONS)]
+            for file_path in paths:
+                if file_path.lower().endswith(BatchProcessor.IMAGE_EXTENSIONS):
+                    with self._timed("decode"):
+                        frame = cv2.imread(file_path)
+                    if frame is not None:
+                        frames.append(frame)
+                    continue
+                cap = cv2.VideoCapture(file_path)
+                try:
+                    while len(frames) < self.frames:
+                        with self._timed("decode"):
+                            ret, frame = cap.read()
+                        if not ret:
+                            break
+                        frames.append(frame)
+                finally:
+                    cap.release()
+                if len(frames) >= self.frames:
+                    return frames
+        return frames or self._synthetic_frames()
+
+    def _synthetic_frames(self, size=(1280, 720), count=60):
+        """Sfondo sfumato con rettangoli in movimento: abbastanza varietà per motion gate e tracker"""
+        w, h = size
+        background = np.zeros((h, w, 3), dtype=np.uint8)
+        background[:] = np.linspace(40, 200, w, dtype=np.uint8)[None, :, None]
+        frames = []
+        for index in range(count):
+            frame = background.copy()
+            for k in range(3):
+                x = int((index * (7 + 5 * k) + 200 * k) % (w - 160))
+                y = 100 + 180 * k
+                cv2.rectangle(frame, (x, y), (x + 120, y + 160), (60 * k, 120, 255 - 60 * k), -1)
+            frames.append(frame)
+        return frames
+
+    def _open_chat(self):
+        """Text Tk nascosto per misurare update_chat, None se non c'è un display"""
+        try:
+            root = tk.Tk()
+            root.withdraw()
+            return root, Text(root)
+        except tk.TclError as e:
+            logging.info(f"Misura della chat saltata, Tk non disponibile: {e}")
+            return None, None
+
+    def run(self):
+        model = load_inference_backend(self.config["inference"])
+        frames = self._load_frames()
+        db_dir = tempfile.mkdtemp(prefix="rico-bench-")
+        db_path = os.path.join(db_dir, "bench.db")
+        prepare_database(db_path)
+        engine = DetectionEngine(self.config, model=model, db_path=db_path)
+        engine.display_size = self.display_size
+        writer = DetectionWriter(db_path)
+        conn = sqlite3.connect(db_path)
+        chat_root, chat = self._open_chat()
+        try:
+            screen = ScreenCapture.from_config(self.config["screen"])
+        except Exception as e:
+            logging.info(f"Misura della cattura schermo saltata: {e}")
+            screen = None
+
+        try:
+            for index in range(self.warmup):
+                self._run_frame(engine, writer, conn, chat, screen, frames[index % len(frames)], index, self._untimed)
+            engine.trackers.clear()
+
+            # Prima passata: solo tempi, senza il costo di tracemalloc
+            gc_before = gc.get_stats()[0]["collections"]
+            total = time.perf_counter()
+            for index in range(self.frames):
+                with self._timed("frame"):
+                    self._run_frame(engine, writer, conn, chat, screen, frames[index % len(frames)], index,
+                                    self._timed)
+            total = time.perf_counter() - total
+            gc_gen0 = gc.get_stats()[0]["collections"] - gc_before
+
+            # Seconda passata: memoria allocata per stadio
+            tracemalloc.start()
+            try:
+                for index in range(self.trace_frames):
+                    self._run_frame(engine, writer, conn, chat, screen, frames[index % len(frames)], index,
+                                    self._traced)
+            finally:
+                tracemalloc.stop()
+        finally:
+            conn.close()
+            if screen is not None:
+                screen.close()
+            if chat_root is not None:
+                chat_root.destroy()
+            engine.close()
+            shutil.rmtree(db_dir, ignore_errors=True)
+
+        return self._results(model, len(frames), total, gc_gen0)
+
+    def _run_frame(self, engine, writer, conn, chat, screen, frame, index, measure):
+        """Un frame attraverso gli stessi stadi della pipeline, in sequenza sullo stesso thread"""
+        now = time.time()
+        if screen is not None:
+            with measure("screen_capture"):
+                screen.grab()
+                screen.commit()
+        frame = frame.copy()  # L'annotazione disegna sul frame, l'originale resta pulito per i giri successivi
+        size = engine.preprocessor.size
+        with measure("motion_gate"):
+            engine.motion_gate.should_infer("bench", frame, now)
+        with measure("preprocess"):
+            image, transform = engine.preprocessor.letterbox(frame, size, index=0)
+        with measure("inference"):
+            results = engine.model.predict([image], size)[0]
+            for det in results:
+                det["box"] = Preprocessor.map_box(det["box"], transform, frame.shape)
+        with measure("tracking"):
+            detections, events = engine._tracker("bench").update(results, now)
+        packet = FramePacket(frame, source="bench")
+        packet.detections = detections
+        with measure("annotate"):
+            engine._annotate_frame(packet)
+        with measure("db_write"):
+            writer.add(detection_rows(events, "bench", now))
+        if index % 20 == 19:
+            # Il thread di scrittura salva circa una volta al secondo: una transazione ogni 20 frame
+            with measure("db_flush"):
+                writer._flush(conn)
+        if chat is not None:
+            labels = ", ".join(det["label"] for det in detections) or "nessun oggetto"
+            with measure("chat"):
+                chat.insert(tk.END, f"{datetime.now().strftime('%H:%M:%S')} - {labels}\n")
+                chat.see(tk.END)
+
+    def _results(self, model, distinct_frames, total, gc_gen0):
+        rss = peak_rss_mb()
+        stages = {}
+        for stage, values in self.timings.items():
+            ms = np.array(values) * 1000
+            stages[stage] = {
+                "samples": len(values),
+                "p50_ms": round(float(np.percentile(ms, 50)), 3),
+                "p95_ms": round(float(np.percentile(ms, 95)), 3),
+                "p99_ms": round(float(np.percentile(ms, 99)), 3),
+                "mean_ms": round(float(ms.mean()), 3),
+                "throughput_fps": round(1000 / float(ms.mean()), 1) if ms.mean() > 0 else None,
+                "alloc_kb_per_frame": None
+            }
+        for stage, values in self.allocations.items():
+            if stage in stages:
+                stages[stage]["alloc_kb_per_frame"] = round(sum(values) / len(values) / 1024, 1)
+        return {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "backend": getattr(model, "name", type(model).__name__),
+            "input_size": self.config["preprocess"]["size"],
+            "inputs": self.inputs or ["sintetici"],
+            "frames": self.frames,
+            "distinct_frames": distinct_frames,
+            "throughput_fps": round(self.frames / total, 1) if total else None,
+            "peak_rss_mb": round(rss, 1) if rss is not None else None,
+            "gc_gen0_per_1000_frames": round(gc_gen0 * 1000 / self.frames, 1) if self.frames else None,
+            "stages": stages
+        }
+
+    @staticmethod
+    def report(results, baseline=None, tolerance=0.1):
+        """Tabella leggibile e, con un riferimento, elenco degli stadi il cui p95 è peggiorato oltre la tolleranza"""
+        lines = [f"Benchmark R.I.C.O ({results['backend']}, {results['input_size']} px, {results['frames']} frame): "
+                 f"{results['throughput_fps']} frame/s, picco RSS {results['peak_rss_mb']} MB, "
+                 f"{results['gc_gen0_per_1000_frames']} GC gen0 ogni 1000 frame",
+                 f"  {'stadio':<16} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'frame/s':>9} {'KB/frame':>9}"
+                 + ("   p95 vs riferimento" if baseline else "")]
+        regressions = []
+        for stage, stats in results["stages"].items():
+            line = (f"  {stage:<16} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} "
+                    f"{stats['throughput_fps'] or 0:>9.1f} {stats['alloc_kb_per_frame'] or 0:>9.1f}")
+            reference = (baseline or {}).get("stages", {}).get(stage)
+            if reference and reference["p95_ms"] > 0:
+                change = stats["p95_ms"] / reference["p95_ms"] - 1
+                line += f"   {change * 100:+6.1f}%"
+                if change > tolerance:
+                    line += "  PEGGIORATO"
+                    regressions.append(stage)
+            lines.append(line)
+        return "\n".join(lines), regressions
+
+class HeadlessService:
+    """Servizio di rilevamento senza interfaccia grafica, pensato per girare come demone su un server"""
+    def __init__(self, sources, config=None, alerts=True, sound=False):
+        self.sources = sources
+        prepare_database()
+        self.engine = DetectionEngine(config)
+        self.engine.event_listeners.append(self._log_events)
+        self.engine.alert_listeners.append(
+            lambda alert: logging.warning(f"[{alert['source']}] {alert['message']}"))
+        if alerts:
+            self.engine.enable_alerts(sound=sound)
+        self.server = None
+        if self.engine.config["server"]["enabled"]:
+            self.server = DetectionServer(self.engine, **self.engine.config["server"])
+        self._stop = threading.Event()
+
+    def _log_events(self, events, source):
+        for event in events:
+            logging.info(f"[{source}] traccia {event['track_id']} {event['event']}: {event['label']}")
+
+    def stop(self, *args):
+        self._stop.set()
+
+    def run(self):
+        import signal
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+        self.engine.load_model()
+        if self.server:
+            self.server.start()
+        captured = 0
+        for source in self.sources:
+            if source == "screen":
+                self.engine.start_screen()
+            else:
+                # Webcam, stream (rtsp://, http://) o file: un processo di cattura ciascuno
+                self.engine.add_source(source)
+                captured += 1
+        logging.info(f"Servizio headless avviato sulle sorgenti: {', '.join(self.sources)}")
+
+        # Quando tutte le sorgenti sono terminate (ad esempio file letti fino in fondo) il servizio esce
+        only_captured = captured == len(self.sources)
+        time.sleep(1.0)
+        while not self._stop.wait(0.5):
+            if only_captured and not self.engine.registry.active():
+                break
+        if self.server:
+            self.server.stop()
+        self.engine.close()
+        logging.info("Servizio headless terminato")
+
 class SplashScreen:
-    def __init__(self, root):
+    def __init__(self, root, loader):
         self.root = root
+        self.loader = loader
         self.root.title("R.I.C.O")
         
         # Rimuovi la barra del titolo di default
@@ -1057,8 +4613,8 @@ class SplashScreen:
         
         # Avvia animazione e caricamento
         self.progress_value = 0
-        self.start_time = time.time()
         self.animate_logo()
+        self.loader.start()
         self.update_progress()
         
     def animate_logo(self):
@@ -1069,31 +4625,90 @@ class SplashScreen:
         pulse()
         
     def update_progress(self):
-        elapsed_time = time.time() - self.start_time
-        progress = min(100, (elapsed_time / 15.0) * 100)  # 15 secondi durata
-        
-        self.progress_value = progress
+        # La barra riflette il completamento reale dei compiti di avvio
+        self.progress_value = self.loader.progress()
         self.progress.set(self.progress_value)
         
-        if progress < 33:
-            self.status_label.config(text="Inizializzazione...")
-        elif progress < 66:
-            self.status_label.config(text="Caricamento moduli...")
-        else:
-            self.status_label.config(text="Completamento...")
-        
-        if progress < 100:
+        pending = self.loader.pending()
+        if pending:
+            self.status_label.config(text=f"Caricamento: {', '.join(pending)}...")
             self.root.after(50, self.update_progress)
         else:
+            self.status_label.config(text="Completamento...")
             self.root.destroy()
 
 if __name__ == "__main__":
-    # Mostra splash screen
-    splash_root = tk.Tk()
-    splash = SplashScreen(splash_root)
-    splash_root.mainloop()
+    parser = argparse.ArgumentParser(description="R.I.C.O - Riconoscimento Intermittente Centro Oggetti")
+    parser.add_argument("command", nargs="?", choices=["bench"],
+                        help="bench: misura ogni stadio della pipeline su frame registrati o sintetici, poi esce")
+    parser.add_argument("--lang", default="it", choices=sorted(languages))
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="misura import e inizializzazione di ogni sottosistema, poi esce")
+    parser.add_argument("--headless", action="store_true",
+                        help="esegue solo cattura, inferenza, allerte e database, senza interfaccia Tk")
+    parser.add_argument("--source", action="append",
+                        help="sorgente headless: indice webcam, 'screen', file video o URL (ripetibile)")
+    parser.add_argument("--no-alerts", action="store_true", help="disattiva le allerte in modalità headless")
+    parser.add_argument("--serve", action="store_true",
+                        help="avvia l'API locale HTTP/WebSocket con rilevamenti, eventi e stream MJPEG")
+    parser.add_argument("--batch", nargs="+", metavar="PERCORSO",
+                        help="elabora offline file video o cartelle di immagini alla massima velocità, poi esce")
+    parser.add_argument("--batch-output", help="file .csv o .parquet di uscita (predefinito: il database)")
+    parser.add_argument("--batch-size", type=int, default=8, help="frame per chiamata al modello in modalità batch")
+    parser.add_argument("--batch-stride", type=int, default=1, help="analizza un frame ogni N in modalità batch")
+    parser.add_argument("--batch-workers", type=int, default=4, help="sorgenti decodificate contemporaneamente")
+    parser.add_argument("--bench-input", nargs="+", metavar="PERCORSO",
+                        help="video o cartelle di immagini da usare nel benchmark (predefinito: frame sintetici)")
+    parser.add_argument("--bench-frames", type=int, default=200, help="frame misurati dal benchmark")
+    parser.add_argument("--bench-output", default="bench_results.json", help="file JSON con i risultati")
+    parser.add_argument("--bench-baseline", help="JSON di un'esecuzione precedente con cui confrontare i risultati")
+    parser.add_argument("--bench-tolerance", type=float, default=0.1,
+                        help="peggioramento massimo del p95 rispetto al riferimento (0.1 = 10%%)")
+    args = parser.parse_args()
+
+    config = load_config()
+    if args.serve:
+        config["server"]["enabled"] = True
+
+    if args.command == "bench":
+        results = Benchmark(config, inputs=args.bench_input, frames=args.bench_frames).run()
+        with open(args.bench_output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        baseline = None
+        if args.bench_baseline:
+            with open(args.bench_baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        report, regressions = Benchmark.report(results, baseline, args.bench_tolerance)
+        print(report)
+        print(f"Risultati salvati in {args.bench_output}")
+        # Uscita non nulla se qualche stadio è peggiorato, così il confronto si può usare in CI
+        raise SystemExit(1 if regressions else 0)
+
+    if args.batch:
+        BatchProcessor(args.batch, config=config, output=args.batch_output,
+                       batch_size=args.batch_size, stride=args.batch_stride, workers=args.batch_workers).run()
+        raise SystemExit(0)
+
+    if args.headless:
+        # Nessuna finestra: i messaggi vanno anche sullo standard error per journald/servizi
+        logging.getLogger().addHandler(logging.StreamHandler())
+        HeadlessService(args.source or ["0"], config=config, alerts=not args.no_alerts).run()
+        raise SystemExit(0)
+
+    # Modello, webcam e database vengono preparati in parallelo dietro lo splash screen
+    loader = StartupLoader([
+        ("modello", 70, lambda: load_inference_backend(config["inference"])),
+        ("webcam", 20, open_camera),
+        ("database", 10, prepare_database)
+    ])
+    with startup_profile.measure("splash screen"):
+        splash_root = tk.Tk()
+        splash = SplashScreen(splash_root, loader)
+        splash_root.mainloop()
     
-    # Avvia l'applicazione principale
+    # Avvia l'applicazione principale appena i compiti sono terminati
     root = tk.Tk()
-    app = ObjectDetectionApp(root, lang="it")
+    app = ObjectDetectionApp(root, lang=args.lang, profile_startup=args.profile_startup,
+                             model=loader.results.get("modello"), cap=loader.results.get("webcam"),
+                             config=config)
     root.mainloop()